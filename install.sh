@@ -5,5 +5,9 @@ mpremote cp src/*.py :
 mpremote cp config/keys :
 mpremote cp config/uprn :
 mpremote cp config/wifi :
+# Optional: prefixes precomputed with tools/precompute.py
+if [ -f config/prefixes ]; then
+    mpremote cp config/prefixes :
+fi
 
 mpremote run src/install.py
@@ -0,0 +1,56 @@
+"""
+A bounded cache of what we decided about each BLE address we have heard recently.
+
+The same address is usually heard many times a second, and which tag (if any) it belongs to can only
+change when a key window moves, so there is no point in decoding it again every time.
+
+When the cache is full the oldest entry goes, so in a busy place the addresses that keep coming back
+stay in it. The hits, misses and evictions are metrics, for sizing the cache.
+"""
+from collections import OrderedDict
+from time import ticks_ms, ticks_add, ticks_diff
+import metrics
+
+class AddressCache:
+    def __init__(self, size, ttl_ms, name = "address_cache"):
+        self.size = size
+        self.ttl_ms = ttl_ms
+        # In the order they were added (micropython's plain dicts do not keep it)
+        self.entries = OrderedDict()
+        self.generation = 0
+        self.hits = metrics.counter(name + ".hits")
+        self.misses = metrics.counter(name + ".misses")
+        self.evictions = metrics.counter(name + ".evictions")
+
+    def get(self, address, generation):
+        """
+        Get the decision for address, or None if there is no usable entry. Everything is discarded
+        if generation differs from the one the entries were made under
+        """
+        if generation != self.generation:
+            self.entries = OrderedDict()
+            self.generation = generation
+        entry = self.entries.get(address)
+        if entry == None:
+            self.misses.add()
+            return None
+        decision, expires = entry
+        if ticks_diff(expires, ticks_ms()) <= 0:
+            del self.entries[address]
+            self.misses.add()
+            return None
+        self.hits.add()
+        return decision
+
+    def put(self, address, decision):
+        """
+        Remember the decision for address
+        """
+        if len(self.entries) >= self.size:
+            # Make room by dropping the oldest entry, which is also the first to expire
+            del self.entries[next(iter(self.entries))]
+            self.evictions.add()
+        self.entries[address] = (decision, ticks_add(ticks_ms(), self.ttl_ms))
+
+    def __str__(self):
+        return f"AddressCache(size={len(self.entries)}/{self.size}, hits={self.hits.value}, misses={self.misses.value}, evictions={self.evictions.value})"
@@ -1,160 +1,383 @@
 """
 Find AirTags that you own without involving Apple in the process
 """
-from binascii import unhexlify
-from time import time
-from collections import deque
+from time import time, ticks_ms, ticks_us, ticks_diff
 import nist224p
-from udatetime import format_date, iso8601_to_timestamp, timestamp_to_iso8601
 import x963
+import log
+from log import Date
+import metrics
+import keyfile
+from tagkey import TagKey
 import asyncio
+import checkpoint
+from prefix_table import PrefixTable
 
 keys = []
-debugging = True
+# Index of the advertised prefixes in every key's window. The low 24 bits of the prefix map to a dict
+# from the high 24 bits to (index of the key, time the prefix is valid from)
+prefix_index = {}
+# Bumped whenever prefix_index changes, so that anything cached from it can be thrown away
+window_generation = 0
 ENDIANNESS = "big"
 WINDOW_SIZE = 8
+# Returned by handle_airtag for anything that is not one of our tags
+UNKNOWN = -1
+# How often the key chains are checkpointed. A reboot replays at most this much of the chain
+CHECKPOINT_INTERVAL = 3 * 60 * 60
+# Comb width for the per-key table for p_0. Each key holds 2^width - 1 precomputed points
+KEY_COMB_WIDTH = 4
+# How long the keyroller may run before it lets the other tasks (scanning especially) have a turn
+KEYROLL_BUDGET_MS = 20
+# Size of AT_i, which is u_i and v_i (36 bytes each) before they are reduced
+AT_SIZE = 72
+# Where roll_key() puts AT_i. Only the event loop uses this; jobs on the executor have their own
+at_buffer = bytearray(AT_SIZE)
 
-def debug(string):
-    if (debugging):
-        print(string)
+DETECTIONS = metrics.counter("airtag.detections")
+PERIODS = metrics.counter("airtag.periods")
+UPDATE_KEY = metrics.histogram("airtag.update_key_us")
+COMPUTE_RESULT = metrics.histogram("nist224p.compute_result_us")
+KEYROLL = metrics.histogram("airtag.keyroll_ms", metrics.MS_BUCKETS)
+# Where the key maths is done. If this is None it is done in time slices on the event loop instead
+executor = None
+# Prefixes precomputed on a host by tools/precompute.py, if there are any
+PREFIX_TABLE = "prefixes"
+prefix_table = None
+# Prefixes from the windows saved before the last reboot, as (prefix, entry in prefix_index). These
+# are only indexed until the key chains have caught up and the real windows are built
+stashed_prefixes = []
 
-def handle_airtag(address, data, rssi, then):
-    timestamp = time()
-    first_byte = address[0] & 0b00111111
-    key_prefix = address[1:].hex()
-    if data[3] == 25:
+def index_prefix(prefix, entry):
+    """
+    Add a 48-bit prefix to prefix_index
+    """
+    high = prefix >> 24
+    low = prefix & 0xffffff
+    bucket = prefix_index.get(low)
+    if bucket == None:
+        bucket = {}
+        prefix_index[low] = bucket
+    bucket[high] = entry
+
+
+def unindex_prefix(prefix, entry):
+    """
+    Remove a 48-bit prefix from prefix_index, if it still refers to entry
+    """
+    high = prefix >> 24
+    low = prefix & 0xffffff
+    bucket = prefix_index.get(low)
+    if bucket != None and bucket.get(high) == entry:
+        del bucket[high]
+        if len(bucket) == 0:
+            del prefix_index[low]
+
+
+def handle_airtag(address, data, offset, rssi, then, end = None):
+    """
+    Check an advertisement against our keys. data is the raw advertisement, and the body of the
+    Apple manufacturer data starts at data[offset] and runs up to data[end] (the end of data if end
+    is None).
+    This runs for every Apple device in range, so it must not allocate: the prefix is handled as
+    two 24-bit halves, which are small ints on micropython, and nothing is sliced or formatted
+    unless it is one of our tags.
+    Returns the index of the key that matched, or UNKNOWN
+    """
+    if end == None or end > len(data):
+        end = len(data)
+    if offset + 3 >= end:
+        # Truncated before the status length
+        return UNKNOWN
+    status_length = data[offset + 3]
+    if offset + 4 + status_length > end:
+        # The status claims more than there is
+        return UNKNOWN
+    if status_length == 25:
        # Full key. Rest of the key is in val[8:..]
        # but we don't really need it - just the prefix
-       special_bits = data[27]
-    elif data[3] == 2:  # Partial key
-       special_bits = data[5]
-    else:
-      print(f"Bad special bits {data[5]}")
-    first_byte |= ((special_bits << 6) & 0b11000000)
-    first_byte &= 0xff
-    if first_byte < 0x10:
-        key_prefix = "0x0" + hex(first_byte)[2] + key_prefix
+       special_bits = data[offset + 27]
+    elif status_length == 2:  # Partial key
+       special_bits = data[offset + 5]
     else:
-        key_prefix = hex(first_byte) + key_prefix
+      log.warning("Bad special bits {}", status_length)
+      return UNKNOWN
+    first_byte = (address[0] & 0b00111111) | ((special_bits << 6) & 0b11000000)
+    high = (first_byte << 16) | (address[1] << 8) | address[2]
+    low = (address[3] << 16) | (address[4] << 8) | address[5]
 
     # Ok, look to see if this corresponds to one of our devices
-    for index, key in enumerate(keys):
-        for pindex, candidate in enumerate(list(key['advertised_prefixes'])):
-            if candidate.startswith(key_prefix):
-                print(f"Tag {key['name']} detected with prefix {key_prefix} (index {pindex}) at distance {rssi} at {format_date(timestamp)}Z")
-                then(key['name'], index, rssi)
-                return
+    bucket = prefix_index.get(low)
+    if bucket == None:
+        # log.debug("Unknown Apple device with prefix {:06x}{:06x} detected at strength {} dBm at {}", high, low, rssi, Date(time()))
+        return UNKNOWN
+    match = bucket.get(high)
+    if match == None:
+        return UNKNOWN
+    index, t_i = match
+    log.info("Tag {} has prefix {:06x}{:06x} (valid from {})", keys[index].name, high, low, Date(t_i))
+    airtag_detected(index, rssi, then)
+    return index
 
-    # print(f"Unknown Apple device with prefix {key_prefix} detected at strength {rssi} dBm at {format_date(timestamp)}Z")
 
-def update_key(key, update_advertised):
+def airtag_detected(index, rssi, then):
     """
-    Update a given key to the next key period
+    Report that the tag for keys[index] has been seen
     """
-    t_i = key['time'] + 15*60
+    DETECTIONS.add()
+    key = keys[index]
+    log.info("Tag {} detected at distance {} at {}", key.name, rssi, Date(time()))
+    then(key.name, index, rssi)
 
-    # Derive SK_1 from SK_0
-    sk_1 = x963.kdf(key['shared_key'], 32, "update")
-    
-    print(f"Updating key {key['name']} to be current from {timestamp_to_iso8601(t_i)}Z")
-    if update_advertised:
-        
-        # Derive AT_1 from SK_1
-        at_1 = x963.kdf(sk_1, 72, "diversify")
 
-        # Derive u_1 and v_1 from this
-        u_1 = int.from_bytes(at_1[:36], ENDIANNESS)
-        v_1 = int.from_bytes(at_1[36:], ENDIANNESS)
+def next_shared_key(sk_0):
+    """
+    Derive SK_1 from SK_0
+    """
+    return x963.kdf(sk_0, 32, b"update")
+
+
+def next_keys(sk_0, at_1):
+    """
+    Derive SK_1 from SK_0, and AT_1 from SK_1, in one go. AT_1 is written into at_1, a buffer of
+    AT_SIZE bytes that the caller can reuse from one period to the next
+    """
+    sk_1 = next_shared_key(sk_0)
+    x963.kdf_into(at_1, sk_1, b"diversify")
+    return sk_1, at_1
 
-        # Reduce u and v into P-224 scalars
-        u_1 = nist224p.reduce(u_1)
-        v_1 = nist224p.reduce(v_1)
+
+def derive_scalars(at_1):
+    """
+    Derive the P-224 scalars u_1 and v_1 from AT_1
+    """
+    # Derive u_1 and v_1 from this
+    u_1 = int.from_bytes(at_1[:36], ENDIANNESS)
+    v_1 = int.from_bytes(at_1[36:], ENDIANNESS)
+
+    # Reduce u and v into P-224 scalars
+    return nist224p.reduce(u_1), nist224p.reduce(v_1)
+
+
+def roll_key_steps(key, derive_point):
+    """
+    Step-wise form of roll_key(). Yields between the point operations of the curve maths
+    """
+    return (yield from metrics.timed_steps(period_steps(key, derive_point), UPDATE_KEY))
+
+
+def period_steps(key, derive_point):
+    """
+    The work of roll_key_steps(), without the timing
+    """
+    t_i = key.time + 15*60
+    PERIODS.add()
+
+    # This runs for every period of a catch-up, so don't even make the Date unless it will be used
+    if log.enabled(log.DEBUG):
+        log.debug("Updating key {} to be current from {}", key.name, Date(t_i))
+    p_1 = None
+    if derive_point:
+        # Derive SK_1 from SK_0, and AT_1 from SK_1
+        sk_1, at_1 = next_keys(key.shared_key, at_buffer)
+        u_1, v_1 = derive_scalars(at_1)
 
         # Compute P_1
-        p_1 = nist224p.compute_result(u_1, key['p_0'], v_1)
-
-        # The deque is initially empty
-        if len(key['advertised_times']) == WINDOW_SIZE:
-            debug(f"At {timestamp_to_iso8601(time())}Z we are dropping old key for {key['name']} that was valid at {timestamp_to_iso8601(key['advertised_times'][0])}Z: ${key['advertised_prefixes'][0]}")
-        # We only really care about the first 6 bytes of the key.
-        # In the near-to-owner case, this is all that is advertised..
-        # The full key is only needed if we want to upload a finding-report to Apple
-        new_prefix = hex(p_1[0])[0:14]
-        print(f"Expecting prefix for {key['name']} to be {new_prefix} at {timestamp_to_iso8601(t_i)}Z (it is currently {timestamp_to_iso8601(time())}Z)")
-        key['advertised_prefixes'].append(new_prefix)
-        key['advertised_times'].append(t_i)
-        print(f"We now have prefixes for {key['name']} from {timestamp_to_iso8601(key['advertised_times'][0])}Z to {timestamp_to_iso8601(key['advertised_times'][-1])}Z")
+        comb = yield from p_0_comb_steps(key)
+        p_1 = yield from metrics.timed_steps(nist224p.compute_result_steps(u_1, key.p_0, v_1, comb), COMPUTE_RESULT)
+    else:
+        # Derive SK_1 from SK_0
+        sk_1 = next_shared_key(key.shared_key)
 
     # Regardless of the prefix stuff, we need to update these values
-    key['time'] = t_i
-    key['shared_key'] = sk_1
+    key.time = t_i
+    key.shared_key = sk_1
+    return p_1
+
+
+def roll_key(key, derive_point):
+    """
+    Advance a given key to the next key period. If derive_point is set, also compute P_1 for the
+    new period and return it in Jacobian coordinates
+    """
+    return nist224p.finish(roll_key_steps(key, derive_point))
+
+
+def point_prefix(p_1):
+    """
+    Get the advertised prefix for P_1 (affine)
+    """
+    # We only really care about the first 6 bytes of the key.
+    # In the near-to-owner case, this is all that is advertised..
+    # The full key is only needed if we want to upload a finding-report to Apple
+    return p_1[0] >> (nist224p.BITS - 48)
+
+
+def table_prefix(key, t_i):
+    """
+    Get the prefix for the period of a key valid from t_i from the precomputed table, or None if
+    there is no table or it does not cover that period
+    """
+    if prefix_table == None:
+        return None
+    return prefix_table.lookup(key.point, t_i)
+
+
+def add_prefix(key, t_i, new_prefix):
+    """
+    Add a prefix to the advertised window of a key, as valid from t_i
+    """
+    # This runs for every period, so only build the debug messages if they are going to be kept
+    debugging = log.enabled(log.DEBUG)
+    if key.count == WINDOW_SIZE:
+        old_prefix = key.prefix(0)
+        old_time = key.period_time(0)
+        if debugging:
+            log.debug("At {} we are dropping old key for {} that was valid at {}: {:012x}", Date(time()), key.name, Date(old_time), old_prefix)
+        unindex_prefix(old_prefix, (key.index, old_time))
+        # The trace is the state just before the oldest prefix in the window, which is what we need
+        # to rebuild the whole window after a reboot. Move it along with the window
+        key.trace = next_shared_key(key.trace)
+        key.trace_time += 15*60
+    if debugging:
+        log.debug("Expecting prefix for {} to be {:012x} at {} (it is currently {})", key.name, new_prefix, Date(t_i), Date(time()))
+    key.push(t_i, new_prefix)
+    index_prefix(new_prefix, (key.index, t_i))
+    global window_generation
+    window_generation += 1
+    if debugging:
+        log.debug("We now have prefixes for {} from {} to {}", key.name, Date(key.period_time(0)), Date(key.period_time(key.count - 1)))
+
+
+def update_key(key, update_advertised):
+    """
+    Update a given key to the next key period
+    """
+    p_1 = roll_key(key, update_advertised)
+    if update_advertised:
+        add_prefix(key, key.time, point_prefix(nist224p.jacobian_to_affine(p_1)))
+
+
+def p_0_comb_steps(key):
+    """
+    Step-wise form of p_0_comb()
+    """
+    if key.p_0_comb == None:
+        key.p_0_comb = yield from nist224p.precompute_steps(nist224p.affine_to_jacobian(key.p_0), KEY_COMB_WIDTH)
+    return key.p_0_comb
+
+
+def p_0_comb(key):
+    """
+    Get the comb table for the public point of a key. p_0 never changes, so this is only built
+    the first time the key actually needs it (rehydration never does)
+    """
+    return nist224p.finish(p_0_comb_steps(key))
+
+
+def make_key(t_0, shared_key, point, name):
+    """
+    Build the record for a key from what is stored in the keys file.
+    point is the public key: x and y, 28 bytes each
+    """
+    return TagKey(t_0, shared_key, point, name, WINDOW_SIZE)
+
+
+def placeholder_key(record):
+    """
+    Build a key that holds the place of a damaged record in the keys file. It is never rolled or
+    matched, and is written back as it was
+    """
+    key = TagKey(0, bytes(32), bytes(56), "(damaged)", WINDOW_SIZE)
+    key.damaged = record
+    return key
 
 
 def parse_key_line(line):
-    chunks = line.split(" ")
-    sync_time = chunks[0]
-    t_0 = iso8601_to_timestamp(sync_time)
-    pkx = chunks[2][2:58]
-    pky = chunks[2][58:]
-    
-    # Micropython doesnt have ecdsa support so I cannot just construct a Point.
-    # Store p_0 as a tuple. We know which curve it is.
-    p_0 = (int.from_bytes(unhexlify(pkx), ENDIANNESS), int.from_bytes(unhexlify(pky), ENDIANNESS))
-
-    
-    return {
-        'time': t_0,
-        'shared_key': unhexlify(chunks[1]),
-        'p_0': p_0,
-        'public_key': chunks[2],
-        'name': " ".join(chunks[3:]),
-        'advertised_prefixes': deque([], WINDOW_SIZE),
-        'advertised_times': deque([], WINDOW_SIZE),
-        'trace': unhexlify(chunks[1]),
-        'trace_time': t_0
-    }
+    return make_key(*keyfile.parse_text_line(line))
 
 
 def load_keys(filename):
     """
-    Load stashed keys
+    Load stashed keys. The file can be in either the text or binary format
     """
-    keyfile = open(filename, "r", encoding="utf-8")
-    min_t = time() - 12*60*60
-    key_lines = keyfile.read().splitlines()
-    for line in key_lines:
-        if line.startswith("#"):
-            continue
-        key = parse_key_line(line)
-        if key['time'] < min_t:
-            min_t = key['time']
+    for record in keyfile.read_records(filename):
+        if isinstance(record, bytes):
+            # Damaged, but it keeps its place so that the later keys still line up with the switches
+            key = placeholder_key(record)
+        else:
+            key = make_key(*record)
+        key.index = len(keys)
         keys.append(key)
-    keyfile.close()
 
 
-def rehydrate_keys():
+def rehydrate_keys_steps():
     """
-    Refresh all keys until they are at most 4 hours old
+    Step-wise form of rehydrate_keys(). Yields after every key period
     """
     # Get all the keys up to date as of 4 hours ago
     oldest = time()
     for key in keys:
+        if key.damaged != None:
+            continue
         i = 0
-        original_time = key['time']
+        original_time = key.time
         if original_time < oldest:
             oldest = original_time
-        print(f"Rehydrating key {key['name']} which was last stashed with timestamp {timestamp_to_iso8601(key['time'])}Z\n")
-        while key['time'] < time() - 4 * 60 * 60:
-            p = 100 * ((key['time'] - original_time) /
-                       (time() - 4 * 60 * 60 - original_time))
+        log.info("Rehydrating key {} which was last stashed with timestamp {}", key.name, Date(key.time))
+        while key.time < time() - 4 * 60 * 60:
             i += 1
             if i == 96:
                 # Provide a periodic update in case this is going to take a long time
                 i = 0
-                print(f"{p:.2f}% {key['name']}")
-                print(f"Key {key['name']} is at {timestamp_to_iso8601(key['time'])}Z")
+                p = 100 * ((key.time - original_time) /
+                           (time() - 4 * 60 * 60 - original_time))
+                log.info("{:.2f}% {}", p, key.name)
+                log.info("Key {} is at {}", key.name, Date(key.time))
             update_key(key, False)
-        print(f"{100}% {key['name']}")
+            yield
+        # There is no advertised window yet, so the trace can start from here
+        key.trace = key.shared_key
+        key.trace_time = key.time
+        log.info("100% {}", key.name)
+    return time() - oldest
+
+
+def rehydrate_keys():
+    """
+    Refresh all keys until they are at most 4 hours old
+    """
+    return nist224p.finish(rehydrate_keys_steps())
+
+
+async def rehydrate_keys_async():
+    """
+    Same as rehydrate_keys(), but with the work done on the executor (if there is one), so that the
+    event loop can carry on in the meantime. Without one it is done in time slices on the event loop
+    """
+    if executor == None:
+        return await run_sliced(rehydrate_keys_steps())
+
+    oldest = time()
+    target = time() - 4 * 60 * 60
+    work = []
+    for key in keys:
+        if key.damaged != None:
+            continue
+        if key.time < oldest:
+            oldest = key.time
+        periods = periods_until(key, target)
+        log.info("Rehydrating key {} which was last stashed with timestamp {} ({} periods)", key.name, Date(key.time), periods)
+        work.append((key, periods, executor.run(advance_chain, key.shared_key, periods)))
+
+    results = await asyncio.gather(*[job for _, _, job in work])
+    for (key, periods, _), shared_key in zip(work, results):
+        key.shared_key = shared_key
+        key.time += periods * 15*60
+        # There is no advertised window yet, so the trace can start from here
+        key.trace = key.shared_key
+        key.trace_time = key.time
+        log.info("100% {}", key.name)
     return time() - oldest
 
 
@@ -163,29 +386,143 @@ def stash_keys(filename):
     Save current key state
     """
     # Save keys so we dont have to do this next time
-    print("Stashing keys")
-    out = open(filename, "w", encoding="utf-8")
+    log.info("Stashing keys")
+    records = []
     for key in keys:
-        out.write(
-            timestamp_to_iso8601(key['trace_time']) +
-            "Z " +
-            key['trace'].hex() +
-            " " +
-            key['public_key'] +
-            " " +
-            key['name'] +
-            "\n"
-        )
-    out.close()
+        if key.damaged != None:
+            records.append(key.damaged)
+        else:
+            records.append((key.trace_time, key.trace, key.point, key.name))
+    keyfile.write_records(filename, records)
 
 
+def update_keys_steps():
+    """
+    Step-wise form of update_keys(). Yields between the point operations of the curve maths
+    """
+    # Roll every key first, keeping the new points in Jacobian coordinates, so that they can all
+    # be converted to affine with a single inversion rather than one each
+    # Periods covered by the prefix table need no curve maths at all
+    pending = []
+    for key in keys:
+        if key.damaged != None:
+            continue
+        while key.time < time() + (WINDOW_SIZE/2) * 15 * 60:
+            if log.enabled(log.DEBUG):
+                log.debug("Key {} needs updating because it has time {} but the end window is {}", key.name, Date(key.time), Date(int(time() + (WINDOW_SIZE/2) * 15 * 60)))
+            prefix = table_prefix(key, key.time + 15*60)
+            p_1 = yield from roll_key_steps(key, prefix == None)
+            pending.append((key, key.time, p_1, prefix))
+
+    points = yield from nist224p.batch_to_affine_steps([p_1 for _, _, p_1, _ in pending])
+    for (key, t_i, _, prefix), p_1 in zip(pending, points):
+        add_prefix(key, t_i, point_prefix(p_1) if prefix == None else prefix)
+    log.info("Key schedule is current")
+
 
 def update_keys():
+    nist224p.finish(update_keys_steps())
+
+
+async def run_sliced(steps, budget_ms = KEYROLL_BUDGET_MS):
+    """
+    Run a step-wise generator from the event loop, letting the other tasks run every time it has
+    had budget_ms of CPU. Returns the result of the generator
+    """
+    start = ticks_ms()
+    try:
+        while True:
+            next(steps)
+            if ticks_diff(ticks_ms(), start) >= budget_ms:
+                await asyncio.sleep(0)
+                start = ticks_ms()
+    except StopIteration as e:
+        return e.value
+
+
+def periods_until(key, t):
+    """
+    How many times a key has to be rolled before it is current as of t
+    """
+    periods = 0
+    t_i = key.time
+    while t_i < t:
+        t_i += 15*60
+        periods += 1
+    return periods
+
+
+def advance_chain(shared_key, periods):
+    """
+    Job: roll a shared key forward by a number of periods.
+    This runs on the worker, so apart from the metrics it must only use its arguments
+    """
+    for _ in range(periods):
+        start = ticks_us()
+        shared_key = next_shared_key(shared_key)
+        PERIODS.add()
+        UPDATE_KEY.observe(ticks_diff(ticks_us(), start))
+    return shared_key
+
+
+def derive_window(shared_key, p_0, comb, periods):
+    """
+    Job: roll a shared key forward by a number of periods, computing P_i for each one.
+    Returns the final shared key, the prefixes of the points in order, and the comb table for p_0
+    (built if comb was None).
+    This runs on the worker, so apart from the metrics it must only use its arguments
+    """
+    if comb == None:
+        comb = nist224p.precompute(nist224p.affine_to_jacobian(p_0), KEY_COMB_WIDTH)
+    points = []
+    at_i = bytearray(AT_SIZE)
+    for _ in range(periods):
+        start = ticks_us()
+        shared_key, _ = next_keys(shared_key, at_i)
+        u_i, v_i = derive_scalars(at_i)
+        computing = ticks_us()
+        points.append(nist224p.compute_result_jacobian(u_i, p_0, v_i, comb))
+        COMPUTE_RESULT.observe(ticks_diff(ticks_us(), computing))
+        PERIODS.add()
+        UPDATE_KEY.observe(ticks_diff(ticks_us(), start))
+    return shared_key, [point_prefix(p_i) for p_i in nist224p.batch_to_affine(points)], comb
+
+
+async def update_keys_async(budget_ms = KEYROLL_BUDGET_MS):
+    """
+    Same as update_keys(), but without blocking the event loop for more than budget_ms at a time.
+    If there is an executor, the work is done there instead
+    """
+    if executor == None:
+        await run_sliced(update_keys_steps(), budget_ms)
+        return
+
+    target = time() + (WINDOW_SIZE/2) * 15 * 60
+    work = []
     for key in keys:
-        while key['time'] < time() + (WINDOW_SIZE/2) * 15 * 60:
-            print(f"Key {key['name']} needs updating because it has time {format_date(key['time'])}Z but the end window is {format_date(int(time() + (WINDOW_SIZE/2) * 15 * 60))}Z\n")
-            update_key(key, True)
-    print("Key schedule is current")
+        if key.damaged != None:
+            continue
+        # Take whatever the prefix table covers first; there is nothing to send to the worker for that
+        while key.time < target:
+            prefix = table_prefix(key, key.time + 15*60)
+            if prefix == None:
+                break
+            roll_key(key, False)
+            add_prefix(key, key.time, prefix)
+        periods = periods_until(key, target)
+        if periods > 0:
+            log.info("Key {} needs {} more periods. Sending it to the worker", key.name, periods)
+            work.append((key, periods, executor.run(derive_window, key.shared_key, key.p_0, key.p_0_comb, periods)))
+
+    # Nothing in the keys changes until all of the results are in
+    results = await asyncio.gather(*[job for _, _, job in work])
+    for (key, periods, _), (shared_key, prefixes, comb) in zip(work, results):
+        key.p_0_comb = comb
+        for prefix in prefixes:
+            key.time += 15*60
+            add_prefix(key, key.time, prefix)
+        key.shared_key = shared_key
+    log.info("Key schedule is current")
 
 
 async def keyroller():
@@ -194,9 +531,23 @@ async def keyroller():
     being the middle of the array
     """
     last_stash = time()
+    last_checkpoint = time()
+    saved_generation = window_generation
     while True:
-        update_keys()
+        start = ticks_ms()
+        await update_keys_async()
+        KEYROLL.observe(ticks_diff(ticks_ms(), start))
+        if len(stashed_prefixes) > 0:
+            # airtag_setup() did not get as far as this, so the real windows have only just been built
+            drop_stashed_windows()
+        # Save the windows whenever they move, so that a reboot can start from them
+        if window_generation != saved_generation:
+            checkpoint.save_windows(keys)
+            saved_generation = window_generation
         await asyncio.sleep(60)
+        if time() - last_checkpoint > CHECKPOINT_INTERVAL:
+            checkpoint.save(keys)
+            last_checkpoint = time()
         # If more than 24 hours has passed since we last stashed the keys then stash them again
         # This is safe in general because only this thread ever updates the key structure (once the boot is finished)
         if time() - last_stash > 86400:
@@ -204,20 +555,65 @@ async def keyroller():
             last_stash = time()
 
 
-def airtag_setup(filename):
+def airtag_load(filename):
     """
-    Prepare the key data in filename
+    Load the keys in filename, and index the windows saved before the last reboot so that scanning
+    can start straight away. This does not need the time to be set
     """
-    print("Loading keys")
+    log.info("Loading keys")
     load_keys(filename)
-    print(f"Loaded {len(keys)} keys. Rehydrating...")
-    key_age = rehydrate_keys()
-    print(f"Keys rehydrated. They had been frozen for {key_age} seconds")
+    global prefix_table
+    prefix_table = PrefixTable.open(PREFIX_TABLE)
+    load_stashed_windows()
+
+
+def load_stashed_windows():
+    """
+    Index the windows saved by the keyroller before the last reboot
+    """
+    global window_generation
+    windows = checkpoint.load_windows()
+    for key in keys:
+        for t_i, prefix in windows.get(key.point, []):
+            entry = (key.index, t_i)
+            index_prefix(prefix, entry)
+            stashed_prefixes.append((prefix, entry))
+    window_generation += 1
+    log.info("Loaded {} stashed prefixes", len(stashed_prefixes))
+
+
+def drop_stashed_windows():
+    """
+    Swap the stashed windows out for the real ones, now that they have been built
+    """
+    global window_generation
+    for prefix, entry in stashed_prefixes:
+        unindex_prefix(prefix, entry)
+    stashed_prefixes.clear()
+    # A stashed prefix can be the same as a real one, in which case it has just been unindexed
+    for key in keys:
+        for i in range(key.count):
+            index_prefix(key.prefix(i), (key.index, key.period_time(i)))
+    window_generation += 1
+
+
+async def airtag_setup(filename):
+    """
+    Bring the keys loaded by airtag_load() up to date. The time must be set first
+    """
+    if checkpoint.restore(keys):
+        log.info("Resuming keys from checkpoint")
+    log.info("Loaded {} keys. Rehydrating...", len(keys))
+    key_age = await rehydrate_keys_async()
+    log.info("Keys rehydrated. They had been frozen for {} seconds", key_age)
     if key_age > 86400:
-        print("Keys are older than 24 hours. Stashing rehydrated keys")
+        log.info("Keys are older than 24 hours. Stashing rehydrated keys")
         stash_keys(filename)
     # Now bring them up to date
-    update_keys()
+    await update_keys_async()
+    drop_stashed_windows()
+    checkpoint.save(keys)
+    checkpoint.save_windows(keys)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,180 @@
+"""
+A small HTTP client built on asyncio streams, so that talking to a slow server does not hold up the
+rest of the event loop the way urequests does.
+
+Requests are made with HTTP/1.0, so the server sends the body as-is (no chunked encoding) and closes
+the connection at the end of it. The body is read in pieces, never all at once.
+
+Everything that can go wrong with a request (no connection, a server that stops answering, a reply
+that makes no sense) is raised as an OSError.
+"""
+import asyncio
+import json
+
+CHUNK_SIZE = 512
+WHITESPACE = b" \t\r\n"
+# Seconds to wait for the connection, or for any one read, before giving up on the request. A
+# half-open connection would otherwise never finish
+TIMEOUT = 30
+
+async def within(awaitable):
+    """
+    Await awaitable, raising OSError if it takes longer than TIMEOUT
+    """
+    try:
+        return await asyncio.wait_for(awaitable, TIMEOUT)
+    except asyncio.TimeoutError:
+        raise OSError("HTTP request timed out")
+
+
+class Response:
+    def __init__(self, reader, writer, status, headers):
+        self.reader = reader
+        self.writer = writer
+        self.status = status
+        # Header names are lower case
+        self.headers = headers
+
+    async def read(self, n = CHUNK_SIZE):
+        """
+        Read up to n bytes of the body. Returns b"" at the end
+        """
+        return await within(self.reader.read(n))
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await within(self.writer.wait_closed())
+        except OSError:
+            # It is closed on our side, which is all that matters
+            pass
+
+
+def split_url(url):
+    """
+    Split a URL into (host, port, path, whether to use TLS)
+    """
+    scheme, _, rest = url.partition("://")
+    host, slash, path = rest.partition("/")
+    use_tls = scheme == "https"
+    port = 443 if use_tls else 80
+    if ":" in host:
+        host, port = host.split(":")
+        port = int(port)
+    return host, port, slash + path, use_tls
+
+
+async def request(method, url, headers = {}, body = None):
+    """
+    Make a request and read the status and headers of the response. The caller must close() the
+    response when it is done with the body
+    """
+    host, port, path, use_tls = split_url(url)
+    reader, writer = await within(asyncio.open_connection(host, port, ssl=use_tls))
+    try:
+        head = f"{method} {path} HTTP/1.0\r\nHost: {host}\r\n"
+        for name, value in headers.items():
+            head += f"{name}: {value}\r\n"
+        if body != None:
+            head += f"Content-Length: {len(body)}\r\n"
+        writer.write((head + "\r\n").encode())
+        if body != None:
+            writer.write(body)
+        await within(writer.drain())
+
+        line = await within(reader.readline())
+        try:
+            status = int(line.split(b" ")[1])
+            response_headers = {}
+            while True:
+                line = await within(reader.readline())
+                if line == b"" or line == b"\r\n":
+                    break
+                name, _, value = line.decode().partition(":")
+                response_headers[name.strip().lower()] = value.strip()
+        except (IndexError, ValueError):
+            raise OSError(f"Bad HTTP response {line}")
+    except Exception:
+        writer.close()
+        raise
+    return Response(reader, writer, status, response_headers)
+
+
+async def get(url, headers = {}):
+    return await request("GET", url, headers)
+
+
+async def post_json(url, data, headers = {}):
+    headers = dict(headers)
+    headers["Content-Type"] = "application/json"
+    return await request("POST", url, headers, json.dumps(data).encode())
+
+
+async def scan_json_array(response, key, each):
+    """
+    Call each() with every element of the first JSON array called key in the body of response,
+    without reading the whole document into memory: only one element is held at a time.
+    Returns the number of elements found
+    """
+    marker = b'"' + key.encode() + b'"'
+    # Until the array starts, only enough is kept to spot the marker across a chunk boundary
+    pending = b""
+    found = False
+    # Nesting inside the current element of the array
+    depth = 0
+    in_string = False
+    escaped = False
+    element = bytearray()
+    count = 0
+    while True:
+        chunk = await response.read()
+        if chunk == b"":
+            return count
+        i = 0
+        if not found:
+            pending += chunk
+            position = pending.find(marker)
+            if position < 0:
+                pending = pending[-len(marker):]
+                continue
+            opening = pending.find(b"[", position)
+            if opening < 0:
+                # Just keep everything from the marker on until the [ turns up
+                pending = pending[position:]
+                continue
+            found = True
+            chunk = pending
+            pending = b""
+            i = opening + 1
+        while i < len(chunk):
+            c = chunk[i]
+            i += 1
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif c == 0x5c: # \
+                    escaped = True
+                elif c == 0x22: # "
+                    in_string = False
+            elif c == 0x22:
+                in_string = True
+            elif depth == 0 and (c == 0x2c or c == 0x5d): # , or the ] that ends the array
+                if len(element) > 0:
+                    try:
+                        value = json.loads(bytes(element))
+                    except ValueError:
+                        raise OSError(f"Bad JSON in {key}")
+                    each(value)
+                    count += 1
+                    element = bytearray()
+                if c == 0x5d:
+                    # There is nothing else we want in the document
+                    return count
+                continue
+            elif c == 0x7b or c == 0x5b: # { or [
+                depth += 1
+            elif c == 0x7d or c == 0x5d: # } or ]
+                depth -= 1
+            elif depth == 0 and c in WHITESPACE:
+                continue
+            element.append(c)
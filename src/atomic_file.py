@@ -0,0 +1,51 @@
+"""
+Small text files that survive a power cut: each one is written to a temporary file and renamed into
+place, with the previous version kept as a backup, and it ends with a CRC so that a file truncated
+part way through is detected and ignored.
+"""
+import os
+from binascii import crc32
+
+def checksum(body):
+    """
+    The checksum line for body
+    """
+    return ("%08x\n" % crc32(body)).encode()
+
+def write(filename, body):
+    """
+    Write body and its checksum to filename, keeping the previous file until the new one is in place
+    """
+    body = body.encode()
+    out = open(filename + ".tmp", "wb")
+    out.write(body)
+    out.write(checksum(body))
+    out.close()
+
+    try:
+        os.rename(filename, filename + ".bak")
+    except OSError:
+        pass
+    os.rename(filename + ".tmp", filename)
+
+def read(filename, header):
+    """
+    Read a file written by write(). Returns the lines after the header, or None if the file is
+    missing, damaged or does not start with header
+    """
+    try:
+        with open(filename, "rb") as file:
+            data = file.read()
+    except OSError:
+        return None
+
+    # The last line is the checksum of everything before it
+    split = data.rfind(b"\n", 0, len(data) - 1) + 1
+    body = data[:split]
+    if data[split:] != checksum(body):
+        return None
+
+    lines = body.decode().splitlines()
+    if len(lines) == 0 or lines[0] != header:
+        return None
+    return lines[1:]
@@ -2,10 +2,16 @@
 Functions for finding out which bins to put out tomorrow if you live in Fife
 
 You need a file called `uprn` containing your UPRN
+
+The collection dates are kept on flash, and which bins go out tomorrow is worked out from them every
+midnight. The council is only asked again when the dates are about to run out or are getting old,
+so the lights stay right when the network is down.
 """
 
-import urequests
-import json
+import async_http
+import atomic_file
+import metrics
+import log
 import utime
 import ure
 import asyncio
@@ -34,45 +40,178 @@ MONTHS = {
     "December": 12
 }
 
-def update_bins(then):
-    # Fetch the auth value
-    response = urequests.get(authURL)
-    auth_header = response.headers.get("Authorization", "")
-    response.close()
+SCHEDULE = "schedule"
+SCHEDULE_VERSION = "1"
+# Fetch again when the schedule is this old, or ends less than this far ahead
+REFRESH_AGE = 7 * 86400
+HORIZON = 14 * 86400
+# How long to wait before trying again if the fetch fails
+RETRY = 3600
 
-    # Post data to the real URL with the extracted Authorization header
-    headers = {"Authorization": auth_header, "Content-Type": "application/json"}
-    response = urequests.post(dataURL, json=payload, headers=headers)
-    data = json.loads(response.text)['data']
-    response.close()
+FETCHES = metrics.counter("bins.fetches")
+FETCH_FAILURES = metrics.counter("bins.fetch_failures")
+UPDATE_BINS = metrics.histogram("bins.update_bins_ms", metrics.MS_BUCKETS)
 
-    result = {}
-    for collection in data['tab_collections']:
-        match = ure.match(r"(\w+), (\w+) (\d+), (\d+)", collection['date'])
-        if not match:
-            continue
+# The collections as a sorted list of (midnight of the collection day, colour)
+schedule = []
+# When the schedule was fetched
+fetched = 0
+
+# The Authorization header from authURL. It is reused until the server rejects it
+auth_header = None
+
+async def fetch_auth():
+    global auth_header
+    response = await async_http.get(authURL)
+    auth_header = response.headers.get("authorization", "")
+    await response.close()
+
+
+async def fetch_collections(each):
+    """
+    Call each() with every entry in the council's list of collections
+    """
+    if auth_header == None:
+        await fetch_auth()
+    response = await async_http.post_json(dataURL, payload, {"Authorization": auth_header})
+    if response.status == 401 or response.status == 403:
+        # The token has expired. Get a new one and try again
+        await response.close()
+        log.info("Bin calendar auth rejected. Fetching a new token")
+        await fetch_auth()
+        response = await async_http.post_json(dataURL, payload, {"Authorization": auth_header})
+    try:
+        if response.status != 200:
+            raise OSError(f"Bin calendar request failed with status {response.status}")
+        # The response is {"data": {"tab_collections": [...], ...}, ...}. Only the collections are
+        # ever held in memory, one at a time
+        await async_http.scan_json_array(response, "tab_collections", each)
+    finally:
+        await response.close()
+
+
+def parse_date(date):
+    """
+    Get midnight of a date like "Friday, October 17, 2025", or None if it is not one
+    """
+    match = ure.match(r"(\w+), (\w+) (\d+), (\d+)", date)
+    if not match:
+        return None
+
+    collection_month = MONTHS.get(match.group(2), 0)
+    if collection_month == 0:
+        return None
+    collection_day = int(match.group(3))
+    collection_year = int(match.group(4))
+
+    return utime.mktime((collection_year, collection_month, collection_day, 0, 0, 0, 0, 0))
+
+
+def midnight(days = 0):
+    """
+    Midnight at the start of today, or that many days from today
+    """
+    (year, month, day, _, _, _, _, _) = utime.localtime()
+    return utime.mktime((year, month, day + days, 0, 0, 0, 0, 0))
 
-        collection_month = MONTHS.get(match.group(2), 0)
-        if collection_month == 0:
-            continue
-        collection_day = int(match.group(3))
-        collection_year = int(match.group(4))
 
-        collection_date = utime.mktime((collection_year, collection_month, collection_day, 0, 0, 0, 0, 0))
-        (year, month, day, _, _, _, _, _) = utime.localtime()
-        tomorrow = utime.mktime((year, month, day + 1, 0, 0, 0, 0, 0))
+async def fetch_schedule():
+    """
+    Fetch the collections from the council and save them
+    """
+    global schedule, fetched
+    collections = []
 
+    def collection_found(collection):
+        collection_date = parse_date(collection['date'])
+        if collection_date != None:
+            collections.append((collection_date, collection['colour']))
+
+    await fetch_collections(collection_found)
+    collections.sort()
+    schedule = collections
+    fetched = utime.time()
+    save_schedule()
+    log.info("Fetched {} bin collections", len(schedule))
+
+
+def save_schedule():
+    body = f"schedule {SCHEDULE_VERSION}\n{fetched}\n"
+    for collection_date, colour in schedule:
+        body += f"{collection_date} {colour}\n"
+    atomic_file.write(SCHEDULE, body)
+
+
+def load_schedule():
+    """
+    Load the saved schedule, if there is one
+    """
+    global schedule, fetched
+    lines = atomic_file.read(SCHEDULE, f"schedule {SCHEDULE_VERSION}")
+    if lines == None:
+        log.info("No saved bin schedule")
+        return
+    fetched = int(lines[0])
+    schedule = []
+    for line in lines[1:]:
+        collection_date, colour = line.split(" ", 1)
+        schedule.append((int(collection_date), colour))
+
+
+def needs_fetch():
+    if len(schedule) == 0 or utime.time() - fetched > REFRESH_AGE:
+        return True
+    return schedule[-1][0] < midnight() + HORIZON
+
+
+def bins_for(day):
+    """
+    Which bins are collected on day (a midnight): a dict from every colour we know about to whether
+    it is collected then
+    """
+    result = {}
+    for collection_date, colour in schedule:
         # This sets the value of result[colour] to be:
-        #    * True if the collection date is tomorrow
+        #    * True if the collection date is day
         #    * True if it was already set to true (regardless of the value here
-        #    * False if it was previously unset or False, and the collection_date is not tomorrow
-        result[collection['colour']] = result.get(collection['colour']) or (collection_date == tomorrow)
+        #    * False if it was previously unset or False, and the collection_date is not day
+        result[colour] = result.get(colour) or (collection_date == day)
+    return result
+
 
-    print(f"Bins updated: {result}")
-    then(result)
+async def update_bins(then):
+    """
+    Work out which bins go out tomorrow, fetching the schedule first if it needs it.
+    Returns False if the fetch failed
+    """
+    start = utime.ticks_ms()
+    ok = True
+    if needs_fetch():
+        FETCHES.add()
+        try:
+            await fetch_schedule()
+        except Exception as e:
+            # Whatever went wrong, the saved schedule is still good enough to set the lights from
+            log.warning("Could not update bins: {!r}", e)
+            FETCH_FAILURES.add()
+            ok = False
+    result = bins_for(midnight(1))
+    log.info("Bins updated: {}", result)
+    await then(result)
+    UPDATE_BINS.observe(utime.ticks_diff(utime.ticks_ms(), start))
+    return ok
 
 async def bin_updater(then):
-    update_bins(then)
+    load_schedule()
     while True:
-        await asyncio.sleep(14400) # 4 hours
-        update_bins(then)
\ No newline at end of file
+        try:
+            ok = await update_bins(then)
+        except Exception as e:
+            # Try again later rather than leave the lights as they are until the next reboot
+            log.error("Could not update bins: {!r}", e)
+            ok = False
+        # Go again just after midnight, when tomorrow changes. Sooner if the fetch failed
+        wait = midnight(1) - utime.time() + 1
+        if not ok:
+            wait = min(wait, RETRY)
+        await asyncio.sleep(wait)
@@ -0,0 +1,100 @@
+"""
+Record what the scanner hears, so that it can be replayed later without radios or tags
+(see tools/replay.py).
+
+The log is:
+    header:  magic "SPBC", version (1 byte), time the capture started (4 bytes, seconds since the epoch)
+    records: ms since the start (4 bytes), RSSI (1 byte, signed), address (6 bytes),
+             length of the advertising data (1 byte), the advertising data
+All integers are big-endian.
+"""
+import struct
+from time import time, ticks_ms, ticks_diff
+import log
+
+MAGIC = b"SPBC"
+VERSION = 1
+HEADER = ">4sBI"
+RECORD = ">Ib6sB"
+# Stop before the capture fills the flash
+LIMIT = 256 * 1024
+
+class Capture:
+    def __init__(self, filename, limit = LIMIT):
+        self.file = open(filename, "wb")
+        self.file.write(struct.pack(HEADER, MAGIC, VERSION, int(time())))
+        self.size = struct.calcsize(HEADER)
+        self.limit = limit
+        self.last = ticks_ms()
+        # Kept as a running total so that the tick counter wrapping does not matter
+        self.elapsed = 0
+        self.count = 0
+
+    def record(self, result):
+        """
+        Record a scan result from aioble
+        """
+        if self.file == None:
+            return
+        now = ticks_ms()
+        self.elapsed += ticks_diff(now, self.last)
+        self.last = now
+        adv_data = result.adv_data
+        self.file.write(struct.pack(RECORD, self.elapsed, result.rssi, bytes(result.device.addr), len(adv_data)))
+        self.file.write(adv_data)
+        self.count += 1
+        self.size += struct.calcsize(RECORD) + len(adv_data)
+        if self.size >= self.limit:
+            log.warning("Capture is full after {} results", self.count)
+            self.close()
+
+    def close(self):
+        if self.file != None:
+            self.file.close()
+            self.file = None
+
+
+class Device:
+    def __init__(self, addr):
+        self.addr = addr
+
+
+class Record:
+    """
+    A scan result read back from a log. It has the parts of aioble's ScanResult that the scanner
+    uses, and ms, the time it was heard since the start of the capture
+    """
+    def __init__(self, ms, rssi, address, adv_data):
+        self.ms = ms
+        self.rssi = rssi
+        self.device = Device(address)
+        self.adv_data = adv_data
+
+
+def read(filename):
+    """
+    Open a log. Returns the time the capture started and a generator of its Records
+    """
+    file = open(filename, "rb")
+    magic, version, start = struct.unpack(HEADER, file.read(struct.calcsize(HEADER)))
+    if magic != MAGIC or version != VERSION:
+        file.close()
+        raise ValueError("Not a capture log")
+    return start, records(file)
+
+
+def records(file):
+    size = struct.calcsize(RECORD)
+    try:
+        while True:
+            record = file.read(size)
+            if len(record) < size:
+                return
+            ms, rssi, address, length = struct.unpack(RECORD, record)
+            adv_data = file.read(length)
+            if len(adv_data) < length:
+                # The capture was cut off part way through a record
+                return
+            yield Record(ms, rssi, address, adv_data)
+    finally:
+        file.close()
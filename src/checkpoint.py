@@ -0,0 +1,102 @@
+"""
+Checkpoints of the key chains, so that a reboot can resume from a recent key period instead of
+replaying every period since the keys file was written.
+
+A checkpoint records, for each key, the chain state just before the oldest prefix in its advertised
+window (key.trace_time and key.trace). It is written with atomic_file, so a power cut leaves either
+the new checkpoint or the previous one as a backup, never a damaged file that is believed.
+
+The advertised windows themselves are saved the same way, in a separate file that is rewritten
+whenever they move. At boot these let the puck recognise its tags straight away, long before it has
+the time and has caught the key chains up.
+"""
+from binascii import unhexlify
+from atomic_file import write, read
+import log
+
+CHECKPOINT = "checkpoint"
+VERSION = "2"
+WINDOWS = "windows"
+WINDOWS_VERSION = "1"
+
+def save(keys, filename = CHECKPOINT):
+    """
+    Write a checkpoint for keys
+    """
+    body = "checkpoint " + VERSION + "\n"
+    for key in keys:
+        if key.damaged != None:
+            # Only holding the place of a damaged record. There is no chain to resume
+            continue
+        body += f"{key.point.hex()} {key.trace_time} {key.trace.hex()}\n"
+    write(filename, body)
+
+def load(filename):
+    """
+    Read a checkpoint. Returns a dict mapping public point to (time, shared key), or None if the file
+    is missing or damaged
+    """
+    lines = read(filename, "checkpoint " + VERSION)
+    if lines == None:
+        return None
+    result = {}
+    for line in lines:
+        point, t, shared_key = line.split(" ")
+        result[unhexlify(point)] = (int(t), unhexlify(shared_key))
+    return result
+
+def restore(keys, filename = CHECKPOINT):
+    """
+    Move each key forward to the newest valid checkpoint, if that is ahead of where the key is now.
+    Returns True if a checkpoint was found
+    """
+    checkpoint = load(filename)
+    if checkpoint == None:
+        log.warning("Checkpoint is missing or damaged. Trying the backup")
+        checkpoint = load(filename + ".bak")
+    if checkpoint == None:
+        return False
+
+    for key in keys:
+        state = checkpoint.get(key.point)
+        if state != None and state[0] > key.time:
+            t, shared_key = state
+            key.time = t
+            key.shared_key = shared_key
+            key.trace_time = t
+            key.trace = shared_key
+    return True
+
+def save_windows(keys, filename = WINDOWS):
+    """
+    Write the advertised window of every key. Each line is the public point, the time the oldest
+    prefix is valid from, and the prefixes in order (consecutive key periods)
+    """
+    body = "windows " + WINDOWS_VERSION + "\n"
+    for key in keys:
+        if key.count == 0:
+            continue
+        prefixes = ",".join([f"{key.prefix(i):012x}" for i in range(key.count)])
+        body += f"{key.point.hex()} {key.period_time(0)} {prefixes}\n"
+    write(filename, body)
+
+def load_windows(filename = WINDOWS):
+    """
+    Read the saved windows. Returns a dict mapping public point to a list of (time, prefix), or an
+    empty dict if there is no usable file
+    """
+    lines = read(filename, "windows " + WINDOWS_VERSION)
+    if lines == None:
+        lines = read(filename + ".bak", "windows " + WINDOWS_VERSION)
+    if lines == None:
+        return {}
+    result = {}
+    for line in lines:
+        point, t, prefixes = line.split(" ")
+        t = int(t)
+        window = []
+        for prefix in prefixes.split(","):
+            window.append((t, int(prefix, 16)))
+            t += 15*60
+        result[unhexlify(point)] = window
+    return result
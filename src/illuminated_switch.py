@@ -1,9 +1,15 @@
 """
 A class representing an illuminated switch to control an Airtag
+
+Everything happens on the event loop. The button callback only sets a flag, which the switch's own
+task picks up, so a press never holds anything else up. The PRIMING -> ARMED deadlines of all of the
+switches are kept on one shared timer wheel that ticks on whole seconds, which is also when blinking
+LEDs are started so that they all blink in step.
 """
 
-from machine import Timer
-import time
+import asyncio
+from time import ticks_ms, ticks_diff
+import log
 
 OFF = 0
 PRIMING = 1
@@ -11,53 +17,143 @@ ARMED = 2
 
 TIMEOUT = 120_000
 #TIMEOUT = 30_000
+# Presses closer together than this are the same press
+DEBOUNCE_MS = 250
+
+class TimerWheel:
+    """
+    One-second timer wheel shared by all of the switches
+    """
+    def __init__(self, slots = 256):
+        self.slots = [[] for _ in range(slots)]
+        # Seconds the wheel has ticked through
+        self.now = 0
+        # Functions to call on the next tick
+        self.pending = []
+        self.count = 0
+        self.wake = asyncio.ThreadSafeFlag()
+
+    def schedule(self, seconds, callback):
+        """
+        Call callback(tick) in seconds' time. Returns the tick it will be called on, which is all
+        there is to cancelling: callbacks check whether they still want the tick they are given
+        """
+        tick = self.now + max(1, seconds)
+        self.slots[tick % len(self.slots)].append((tick, callback))
+        self.count += 1
+        self.wake.set()
+        return tick
+
+    def next_tick(self, callback):
+        """
+        Call callback() on the next whole second
+        """
+        self.pending.append(callback)
+        self.wake.set()
+
+    def __tick(self):
+        self.now += 1
+        pending = self.pending
+        self.pending = []
+        for callback in pending:
+            callback()
+        slot = self.slots[self.now % len(self.slots)]
+        # Anything a whole turn or more away stays where it is
+        due = [entry for entry in slot if entry[0] <= self.now]
+        if len(due) == 0:
+            return
+        slot[:] = [entry for entry in slot if entry[0] > self.now]
+        self.count -= len(due)
+        for tick, callback in due:
+            callback(tick)
+
+    async def run(self):
+        while True:
+            if self.count == 0 and len(self.pending) == 0:
+                # Nothing to do until something is scheduled
+                await self.wake.wait()
+                continue
+            # Sleep to the next whole second
+            await asyncio.sleep_ms(1000 - (ticks_ms() % 1000))
+            self.__tick()
+
+
+wheel = TimerWheel()
 
 class IlluminatedSwitch:
-    def __init__(self, led, switch, trigger):
+    def __init__(self, led, switch, trigger, on_change = None):
         self.led = led
         self.switch = switch
         self.state = OFF
-        self.timer = Timer(-1)
+        # The wheel tick we are waiting for to arm, if we are priming
+        self.deadline = None
         self.trigger = trigger
+        # Called with the switch whenever its state changes
+        self.on_change = on_change
         self.led.value = 0
-        self.switch.when_pressed = self.__handle_press
+        # Set by the button callback; the press itself is handled by run()
+        self.pressed = asyncio.ThreadSafeFlag()
+        self.last_press = ticks_ms() - DEBOUNCE_MS
+        self.switch.when_pressed = self.pressed.set
+
+    def __set_state(self, state):
+        self.state = state
+        if self.on_change != None:
+            self.on_change(self)
 
     def __prime(self):
-        print("Priming")
-        # Stop any previous timers, to avoid leaking one
-        self.timer.deinit()
-        self.timer = Timer(period = TIMEOUT, mode = Timer.ONE_SHOT, callback = self.__arm)
+        log.info("Priming")
+        # Any earlier deadline is simply ignored when it comes round
+        self.deadline = wheel.schedule(TIMEOUT // 1000, self.__arm)
+
+    def __start_blinking(self):
+        # Started on a whole second, so that every priming switch blinks in step
+        if self.state == PRIMING:
+            self.led.blink(0.5)
 
     def __handle_press(self):
         if self.state == OFF:
-            self.state = PRIMING
-            time.sleep_ms(1000 - (time.ticks_ms() % 1000))
-            self.led.blink(0.5)
+            self.__set_state(PRIMING)
+            wheel.next_tick(self.__start_blinking)
             self.__prime()
         elif self.state == PRIMING:
-            self.timer.deinit()
-            self.state = OFF
+            self.deadline = None
+            self.__set_state(OFF)
             self.led.off()
         elif self.state == ARMED:
-            self.timer.deinit()
-            self.state = OFF
+            self.__set_state(OFF)
             self.led.off()
-    
-    def __arm(self, t):
-        print("Arming")
-        self.state = ARMED
-        self.timer.deinit()
+
+    def __arm(self, tick):
+        if self.state != PRIMING or tick != self.deadline:
+            # Cancelled or re-primed since this was scheduled
+            return
+        log.info("Arming")
+        self.deadline = None
+        self.__set_state(ARMED)
         self.led.on()
 
+    async def run(self):
+        """
+        Handle presses of the button
+        """
+        while True:
+            await self.pressed.wait()
+            now = ticks_ms()
+            if ticks_diff(now, self.last_press) < DEBOUNCE_MS:
+                continue
+            self.last_press = now
+            self.__handle_press()
+
     def found(self):
-        print("Detected")
+        log.info("Detected")
         if self.state == ARMED:
             self.trigger()
-            self.state = OFF
+            self.__set_state(OFF)
             self.led.off()
         if self.state == PRIMING:
-            print("Re-priming")
+            log.info("Re-priming")
             self.__prime()
 
     def __str__(self):
-        return f"IlluminatedSwitch(led={self.led}, switch={self.switch})"
\ No newline at end of file
+        return f"IlluminatedSwitch(led={self.led}, switch={self.switch})"
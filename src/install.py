@@ -15,5 +15,4 @@ while wlan.isconnected() == False:
 print("Connected!")
 
 mip.install('aioble')
-mip.install('urequests')
 mip.install('https://raw.githubusercontent.com/RaspberryPiFoundation/picozero/master/picozero/picozero.py')
\ No newline at end of file
@@ -0,0 +1,121 @@
+"""
+Reading and writing the keys file.
+
+The original format is text, one key per line:
+    <sync time (ISO-8601)> <shared key (hex)> <public key (2 characters, then x and y in hex)> <name>
+Lines starting with # are ignored.
+
+The binary format is an 8 byte header (magic "SPKF", version, record size, 2 reserved bytes) and
+then one fixed-size record per key:
+    sync time (4 bytes), shared key (32 bytes), public point x || y (56 bytes), name (32 bytes,
+    UTF-8, zero padded), CRC32 of the preceding 124 bytes (4 bytes)
+All integers are big-endian. Both formats are read one record at a time, so the whole file is never
+in memory at once.
+
+A binary record that fails its CRC is generated as its raw bytes rather than skipped: the keys have
+to stay in the same order as the switches, and writing it back as it was means it is not lost.
+"""
+import os
+import struct
+import log
+from binascii import crc32, unhexlify
+from udatetime import iso8601_to_timestamp
+
+MAGIC = b"SPKF"
+VERSION = 1
+HEADER = ">4sBBH"
+RECORD = ">I32s56s32s"
+RECORD_SIZE = struct.calcsize(RECORD) + 4
+NAME_SIZE = 32
+
+def parse_text_line(line):
+    """
+    Parse a line of the text format into (sync time, shared key, public point, name)
+    """
+    chunks = line.split(" ")
+    t_0 = iso8601_to_timestamp(chunks[0])
+    point = unhexlify(chunks[2][2:])
+    return (t_0, unhexlify(chunks[1]), point, " ".join(chunks[3:]))
+
+def read_records(filename):
+    """
+    Generate (sync time, shared key, public point, name) for every key in a keys file, in either format
+    """
+    file = open(filename, "rb")
+    try:
+        header = file.read(struct.calcsize(HEADER))
+        if header[:4] == MAGIC:
+            yield from read_binary(file, header)
+        else:
+            file.close()
+            file = open(filename, "r", encoding="utf-8")
+            for line in file:
+                line = line.strip()
+                if len(line) == 0 or line.startswith("#"):
+                    continue
+                yield parse_text_line(line)
+    finally:
+        file.close()
+
+def read_binary(file, header):
+    """
+    Generate the records of a binary keys file, positioned just after the header. Damaged records
+    are generated as their raw bytes
+    """
+    _, version, record_size, _ = struct.unpack(HEADER, header)
+    if version != VERSION or record_size != RECORD_SIZE:
+        raise ValueError(f"Unsupported keys file version {version}")
+    number = 0
+    while True:
+        record = file.read(RECORD_SIZE)
+        if len(record) < RECORD_SIZE:
+            return
+        body = record[:-4]
+        if struct.unpack(">I", record[-4:])[0] != crc32(body):
+            log.warning("Key record {} is damaged. Keeping its place, but it will never match", number)
+            yield record
+            number += 1
+            continue
+        number += 1
+        t_0, shared_key, point, name = struct.unpack(RECORD, body)
+        yield (t_0, shared_key, point, name.rstrip(b"\0").decode())
+
+def encode_name(name):
+    """
+    Encode a name for a binary record. Names longer than NAME_SIZE bytes are cut short, on a
+    character boundary so that they still decode
+    """
+    encoded = name.encode()
+    if len(encoded) <= NAME_SIZE:
+        return encoded
+    end = NAME_SIZE
+    # Back off past any continuation bytes (0b10xxxxxx) to the start of the character that is cut
+    while end > 0 and encoded[end] & 0xc0 == 0x80:
+        end -= 1
+    log.warning("Key name {} is longer than {} bytes. Shortening it", name, NAME_SIZE)
+    return encoded[:end]
+
+def write_records(filename, records):
+    """
+    Write (sync time, shared key, public point, name) records as a binary keys file. A damaged
+    record from read_records() (raw bytes) is written back exactly as it was.
+    The file is written to one side and then renamed into place
+    """
+    out = open(filename + ".tmp", "wb")
+    out.write(struct.pack(HEADER, MAGIC, VERSION, RECORD_SIZE, 0))
+    for record in records:
+        if isinstance(record, bytes):
+            out.write(record)
+            continue
+        t_0, shared_key, point, name = record
+        body = struct.pack(RECORD, t_0, shared_key, point, encode_name(name))
+        out.write(body)
+        out.write(struct.pack(">I", crc32(body)))
+    out.close()
+    os.rename(filename + ".tmp", filename)
+
+def convert(text_filename, binary_filename):
+    """
+    Convert a text keys file to the binary format
+    """
+    write_records(binary_filename, read_records(text_filename))
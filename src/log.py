@@ -0,0 +1,148 @@
+"""
+Logging that costs next to nothing when nobody is going to read it.
+
+    log.info("Tag {} detected at {}", name, log.Date(time()))
+
+The level is checked before anything else happens, and the message is only formatted when it is
+written out, so the key maths is not slowed down by building strings (or formatting dates) for
+every key period. Messages go into a fixed-size ring buffer, which flusher() writes to the console
+(and optionally a file on flash) when the event loop has nothing better to do. Until flusher() is
+started, messages are written straight away.
+
+The arguments are kept until the message is written, so pass values, not objects that are about to
+change.
+"""
+import asyncio
+import os
+from udatetime import timestamp_to_iso8601
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+PREFIXES = {DEBUG: "", INFO: "", WARNING: "Warning: ", ERROR: "Error: "}
+
+level = INFO
+# How many messages can wait to be written. If more than this arrive before the flusher runs, the
+# oldest are dropped
+BUFFER_SIZE = 64
+# Also append the log to this file, if it is set. It is moved to FILE + ".old" when it reaches
+# FILE_LIMIT bytes, so at most twice that is ever on flash
+FILE = None
+FILE_LIMIT = 32 * 1024
+
+buffer = [None] * BUFFER_SIZE
+first = 0
+count = 0
+dropped = 0
+buffered = False
+
+class Date:
+    """
+    A timestamp that is only formatted (as ISO-8601) if the message it is in is written
+    """
+    __slots__ = ('timestamp',)
+
+    def __init__(self, timestamp):
+        self.timestamp = timestamp
+
+    def __str__(self):
+        return timestamp_to_iso8601(self.timestamp)
+
+
+def enabled(message_level):
+    """
+    Whether messages at message_level are being kept. Check this before working out anything
+    expensive that is only needed for a message
+    """
+    return message_level >= level
+
+def debug(message, *args):
+    if DEBUG >= level:
+        add(DEBUG, message, args)
+
+def info(message, *args):
+    if INFO >= level:
+        add(INFO, message, args)
+
+def warning(message, *args):
+    if WARNING >= level:
+        add(WARNING, message, args)
+
+def error(message, *args):
+    if ERROR >= level:
+        add(ERROR, message, args)
+
+
+def add(message_level, message, args):
+    global first, count, dropped
+    if not buffered:
+        write([render((message_level, message, args))])
+        return
+    if count == BUFFER_SIZE:
+        # Drop the oldest
+        first = (first + 1) % BUFFER_SIZE
+        count -= 1
+        dropped += 1
+    buffer[(first + count) % BUFFER_SIZE] = (message_level, message, args)
+    count += 1
+
+
+def render(entry):
+    message_level, message, args = entry
+    if len(args) > 0:
+        message = message.format(*args)
+    return PREFIXES[message_level] + message
+
+
+def write(lines):
+    for line in lines:
+        print(line)
+    if FILE == None:
+        return
+    try:
+        if os.stat(FILE)[6] >= FILE_LIMIT:
+            os.rename(FILE, FILE + ".old")
+    except OSError:
+        pass
+    with open(FILE, "a") as file:
+        for line in lines:
+            file.write(line + "\n")
+
+
+def flush(limit = BUFFER_SIZE):
+    """
+    Write out up to limit waiting messages. Returns how many are still waiting
+    """
+    global first, count, dropped
+    lines = []
+    if dropped > 0:
+        lines.append(f"{PREFIXES[WARNING]}{dropped} log messages dropped")
+        dropped = 0
+    while count > 0 and len(lines) < limit:
+        entry = buffer[first]
+        buffer[first] = None
+        first = (first + 1) % BUFFER_SIZE
+        count -= 1
+        lines.append(render(entry))
+    if len(lines) > 0:
+        write(lines)
+    return count
+
+
+async def flusher(interval_ms = 250, batch = 8):
+    """
+    Write the log out in the background: a few messages at a time, so that the other tasks never
+    wait long behind it
+    """
+    global buffered
+    buffered = True
+    try:
+        while True:
+            if flush(batch) > 0:
+                await asyncio.sleep(0)
+            else:
+                await asyncio.sleep(interval_ms / 1000)
+    finally:
+        buffered = False
+        flush()
@@ -5,14 +5,25 @@ Entry point for the smart-puck application
 import asyncio
 import network
 import ntptime
-from time import sleep
+import scanner
 from scanner import scan_devices
+from capture import Capture
 from bins import bin_updater
-from illuminated_switch import IlluminatedSwitch
+import illuminated_switch
+from illuminated_switch import IlluminatedSwitch, OFF
 from picozero import LED, Button, Buzzer
-from airtag import airtag_setup, keyroller
+import airtag
+import log
+import metrics
+from airtag import airtag_load, airtag_setup, keyroller
+from worker import get_executor
 
 NEARBY = -80
+# Set this to a filename to record everything the scanner hears, for tools/replay.py
+CAPTURE_FILE = None
+# Seconds to wait before asking NTP again if it fails. This doubles every time, up to NTP_RETRY_MAX
+NTP_RETRY = 5
+NTP_RETRY_MAX = 600
 
 binLEDs = {
     "Blue": LED(18),
@@ -24,26 +35,32 @@ binLEDs = {
 doorbell = Buzzer(22)
 
 def ring_doorbell():
-    print("Ding dong")
+    log.info("Ding dong")
     doorbell.on(1, 1, False)
 
+def switch_changed(_switch):
+    # Only scan flat out while a switch is waiting for its tag
+    scanner.set_active(any([switch.state != OFF for switch in airtags]))
+
 # The order of these has to match the order of the keys in the keys file
 airtags = [
-    IlluminatedSwitch(LED(1), Button(2), ring_doorbell),
-    IlluminatedSwitch(LED(8), Button(9), ring_doorbell)
+    IlluminatedSwitch(LED(1), Button(2), ring_doorbell, switch_changed),
+    IlluminatedSwitch(LED(8), Button(9), ring_doorbell, switch_changed)
 ]
 
 async def bins_updated(to):
-    for colour, state in to:
-        binLEDs[colour].value = state
+    for colour, state in to.items():
+        # The council has more colours of bin than we have lights
+        led = binLEDs.get(colour)
+        if led != None:
+            led.value = state
 
 def airtag_found(_name, index, rssi):
     if rssi > NEARBY:
         airtags[index].found()
 
 
-async def main():
-    binLEDs['Blue'].blink(1)
+async def connect_wifi():
     with open('wifi', 'r') as file:
         ssid = file.readline().strip()
         password = file.readline().strip()
@@ -52,32 +69,89 @@ async def main():
     wlan.active(True)
     wlan.connect(ssid, password)
     while wlan.isconnected() == False:
-        print('Waiting for wifi connection...')
-        sleep(1)
-    print("Connected!")
+        log.info("Waiting for wifi connection...")
+        await asyncio.sleep(1)
+    log.info("Connected!")
+
+
+async def set_time():
+    """
+    Set the clock from NTP, trying again (less and less often) until it works. Nothing that needs
+    the time can start until it has
+    """
+    wait = NTP_RETRY
+    while True:
+        try:
+            ntptime.settime()
+            return
+        except Exception as e:
+            log.warning("Could not set the time: {!r}. Trying again in {}s", e, wait)
+        await asyncio.sleep(wait)
+        wait = min(wait * 2, NTP_RETRY_MAX)
+
+
+async def boot():
+    """
+    Everything that needs the network: this runs alongside the scanner, which starts out using the
+    windows saved before the reboot. A step that fails is logged, and the ones after it still run
+    """
+    binLEDs['Blue'].blink(1)
+    await connect_wifi()
     binLEDs['Blue'].on()
     binLEDs['Green'].blink()
 
     # Now we have internet, set the time
-    ntptime.settime()
+    await set_time()
+
+    # The log records the time it started, so it has to wait for the clock
+    if CAPTURE_FILE != None:
+        try:
+            scanner.capture = Capture(CAPTURE_FILE)
+        except OSError as e:
+            log.error("Could not start the capture: {!r}", e)
 
     # To do: set up IO, check LED status source
-    airtag_setup("keys")
+    # Catch the keys up. The scanner switches over to the real windows when this is done
+    try:
+        await airtag_setup("keys")
+    except Exception as e:
+        # The keyroller catches the keys up by itself, just more slowly
+        log.error("Could not set up the keys: {!r}", e)
     binLEDs['Green'].on()
 
-
     for led in binLEDs:
         binLEDs[led].off()
 
-    # Start scanning
-    asyncio.create_task(scan_devices(airtag_found))
-
     # Start updating bins
     asyncio.create_task(bin_updater(bins_updated))
 
     # Start keyroller
     asyncio.create_task(keyroller())
 
+
+async def main():
+    # Write the log out when there is nothing more important to do
+    asyncio.create_task(log.flusher())
+    # Keep an eye on how things are going
+    asyncio.create_task(metrics.lag_probe())
+    asyncio.create_task(metrics.reporter())
+
+    # The switches work from the event loop, so they can be used straight away
+    asyncio.create_task(illuminated_switch.wheel.run())
+    for switch in airtags:
+        asyncio.create_task(switch.run())
+
+    # The key maths runs on the second core
+    airtag.executor = get_executor()
+    # This does not need the network or the time, so we can be looking for tags within seconds
+    airtag_load("keys")
+
+    # Start scanning
+    asyncio.create_task(scan_devices(airtag_found))
+
+    # Connect, set the time and catch the keys up
+    asyncio.create_task(boot())
+
     # Wait forever
     await asyncio.Event().wait()
 
@@ -0,0 +1,152 @@
+"""
+Counters and histograms for seeing how the puck is really doing.
+
+Modules make their metrics once, at import, and keep them:
+
+    RESULTS = metrics.counter("scanner.results")
+    ...
+    RESULTS.add()
+
+so that recording is just an attribute update, with no lookups or allocation. Histograms have fixed
+buckets for the same reason. reporter() logs a summary every so often and saves a snapshot as JSON
+for anything that wants to read it.
+
+Metrics can also be recorded by jobs on the second core. A count might occasionally be lost to a
+race there, which is fine for what these are for. Jobs in a process pool on a host record in their
+own process, so they are not seen here at all.
+"""
+import asyncio
+import json
+import log
+from time import time, ticks_ms, ticks_us, ticks_diff
+
+SNAPSHOT = "metrics"
+# Bucket upper bounds for histograms of microseconds and milliseconds
+US_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+MS_BUCKETS = (1, 5, 20, 100, 500, 2_000, 10_000, 60_000)
+
+registry = {}
+started = time()
+
+class Counter:
+    def __init__(self, name):
+        self.name = name
+        self.value = 0
+        # The value at the last report, for working out the rate
+        self.reported = 0
+
+    def add(self, n = 1):
+        self.value += n
+
+    def snapshot(self):
+        return {"value": self.value}
+
+    def summary(self, seconds):
+        rate = (self.value - self.reported) / max(seconds, 1)
+        self.reported = self.value
+        return f"{self.name} {self.value} ({rate:.1f}/s)"
+
+
+class Histogram:
+    def __init__(self, name, bounds):
+        self.name = name
+        self.bounds = bounds
+        # One more bucket for anything over the last bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.bounds) and value > self.bounds[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def snapshot(self):
+        return {"bounds": list(self.bounds), "counts": self.counts, "count": self.count, "total": self.total, "max": self.max}
+
+    def summary(self, seconds):
+        if self.count == 0:
+            return f"{self.name} -"
+        return f"{self.name} n={self.count} mean={self.total / self.count:.0f} p90<={self.percentile(90)} max={self.max}"
+
+    def percentile(self, p):
+        """
+        The bucket bound that p percent of the values are at or under
+        """
+        target = self.count * p / 100
+        seen = 0
+        for i in range(len(self.bounds)):
+            seen += self.counts[i]
+            if seen >= target:
+                return self.bounds[i]
+        return self.max
+
+
+def counter(name):
+    return registry.setdefault(name, Counter(name))
+
+def histogram(name, bounds = US_BUCKETS):
+    return registry.setdefault(name, Histogram(name, bounds))
+
+
+def timed_steps(steps, histogram):
+    """
+    Run a step-wise generator (see nist224p.finish), passing its steps on, and record in histogram
+    how long it spent running in microseconds. The time between steps, when the caller is doing
+    something else, does not count
+    """
+    elapsed = 0
+    while True:
+        start = ticks_us()
+        try:
+            next(steps)
+        except StopIteration as e:
+            histogram.observe(elapsed + ticks_diff(ticks_us(), start))
+            return e.value
+        elapsed += ticks_diff(ticks_us(), start)
+        yield
+
+
+LOOP_LAG = histogram("loop.lag_ms", MS_BUCKETS)
+
+async def lag_probe(interval_ms = 100):
+    """
+    Measure how late the event loop wakes a task up. Anything that hogs the loop shows up here
+    """
+    while True:
+        start = ticks_ms()
+        await asyncio.sleep(interval_ms / 1000)
+        LOOP_LAG.observe(max(0, ticks_diff(ticks_ms(), start) - interval_ms))
+
+
+def snapshot():
+    """
+    All of the metrics, in a form that can be saved as JSON
+    """
+    result = {"time": time(), "uptime": time() - started}
+    for name, metric in registry.items():
+        result[name] = metric.snapshot()
+    return result
+
+
+def save(filename = SNAPSHOT):
+    with open(filename, "w") as file:
+        json.dump(snapshot(), file)
+
+
+async def reporter(interval = 600, filename = SNAPSHOT):
+    """
+    Log a summary of the metrics every interval seconds, and save a snapshot
+    """
+    while True:
+        await asyncio.sleep(interval)
+        for name in sorted(registry):
+            log.info("metrics: {}", registry[name].summary(interval))
+        if filename != None:
+            save(filename)
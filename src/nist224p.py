@@ -10,14 +10,25 @@ n = 0xffffffffffffffffffffffffffff16a2e0b8f03e13dd29455c5c2a3d
 G = (0xb70e0cbd6bb4bf7f321390b94a03c1d356c21122343280d6115c1d21, 0xbd376388b5f723fb4c22dfe6cd4375a05a07476444d5819985007e34, 1)
 # Curve equation: y^2 = x^3 + ax + b (mod p)
 
+# All scalars we deal with are reduced mod n, so they fit in this many bits
+BITS = 224
+# Comb width for the fixed-base table for G. Larger is faster but the table has 2^width - 1 entries
+G_COMB_WIDTH = 5
+
 import time
+from nist224p_field import reduce as freduce, mul as fmul, sqr as fsqr, inv as finv, inv_steps as finv_steps
+
+try:
+    # Generated by write_comb_module() so that the device does not have to build it at boot
+    from nist224p_g import G_COMB
+except ImportError:
+    G_COMB = None
 
 def mod_inv(n):
     """
-    Compute modular inverse using Fermat's little theorem.
-    Whether this is faster than the Euclidean algorithm depends on whether pow() is optimized or not
+    Compute modular inverse using Fermat's little theorem, via the addition chain in nist224p_field
     """
-    return pow(n, p - 2, p)
+    return finv(n)
 
 def affine_to_jacobian(point):
     """
@@ -32,33 +43,98 @@ def jacobian_to_affine(point):
     """
     x,y,z = point
     z_inv = mod_inv(z)
-    z_inv2 = (z_inv * z_inv) % p
-    z_inv3 = (z_inv2 * z_inv) % p
-    x = (x * z_inv2) % p
-    y = (y * z_inv3) % p
+    z_inv2 = fsqr(z_inv)
+    z_inv3 = fmul(z_inv2, z_inv)
+    x = fmul(x, z_inv2)
+    y = fmul(y, z_inv3)
     return (x, y)
 
+def batch_to_affine_steps(points):
+    """
+    Step-wise form of batch_to_affine(). Yields after every point, and every few squarings of the
+    inversion
+    """
+    # products[i] is the product of every Z up to and including points[i]
+    products = []
+    product = 1
+    for point in points:
+        if point != None:
+            product = fmul(product, point[2])
+        products.append(product)
+        yield
+
+    # Walk backwards, peeling one Z off the inverse of the product at a time
+    inverse = yield from finv_steps(product)
+    result = [None] * len(points)
+    for i in range(len(points) - 1, -1, -1):
+        point = points[i]
+        if point == None:
+            continue
+        x,y,z = point
+        z_inv = fmul(inverse, products[i - 1]) if i > 0 else inverse
+        inverse = fmul(inverse, z)
+        z_inv2 = fsqr(z_inv)
+        result[i] = (fmul(x, z_inv2), fmul(y, fmul(z_inv2, z_inv)))
+        yield
+    return result
+
+def batch_to_affine(points):
+    """
+    Convert a list of Jacobian points to affine (x, y) using a single inversion (Montgomery's trick).
+    Points at infinity (None) are passed through unchanged.
+    """
+    return finish(batch_to_affine_steps(points))
+
 def double(point):
     """
     Point doubling in Jacobian coordinates.
-    Uses dbl-1998-cmo-2 (http://www.hyperelliptic.org/EFD/g1p/auto-shortw-jacobian.html#doubling-dbl-1998-cmo-2)
+    Uses dbl-2001-b (http://www.hyperelliptic.org/EFD/g1p/auto-shortw-jacobian-3.html#doubling-dbl-2001-b)
+    which relies on a = -3, as it is for this curve
     """
     x,y,z = point
     if y == 0:
         # At y = 0 we are always at the nub of the curve so the tangent is always vertical
         return None  # Point at infinity
 
-    yy = (y * y) % p
-    xx = (x * x) % p
-    zz = (z * z) % p
-    s = (4 * x * yy) % p
-    m = (3 * xx + a * zz * zz) % p
-    t = (m * m - 2 * s) % p
-    x2 = t
-    y2 = (m * (s - t) - 8 * yy * yy) % p
-    z2 = (2 * y * z) % p
+    delta = fsqr(z)
+    gamma = fsqr(y)
+    beta = fmul(x, gamma)
+    alpha = freduce(3 * (x - delta) * (x + delta))
+    x2 = freduce(alpha * alpha - 8 * beta)
+    z2 = freduce((y + z) * (y + z) - gamma - delta)
+    y2 = freduce(alpha * (4 * beta - x2) - 8 * gamma * gamma)
     return (x2, y2, z2)
 
+def add_mixed(p1, p2):
+    """
+    Point addition where p2 has Z = 1, as G and every precomputed table entry do.
+    Uses madd-2007-bl (http://www.hyperelliptic.org/EFD/g1p/auto-shortw-jacobian-3.html#addition-madd-2007-bl)
+    """
+    x1, y1, z1 = p1
+    x2, y2, _ = p2
+
+    z1z1 = fsqr(z1)
+    u2 = fmul(x2, z1z1)
+    s2 = fmul(y2, fmul(z1, z1z1))
+
+    # Same reasoning as in add() below
+    if u2 == x1:
+        if s2 == y1:
+            return double(p1)
+        else:
+            return None
+
+    H = freduce(u2 - x1)
+    HH = fsqr(H)
+    I = 4 * HH
+    J = fmul(H, I)
+    r = 2 * (s2 - y1)
+    V = fmul(x1, I)
+    x3 = freduce(r * r - J - 2 * V)
+    y3 = freduce(r * (V - x3) - 2 * y1 * J)
+    z3 = freduce((z1 + H) * (z1 + H) - z1z1 - HH)
+    return (x3, y3, z3)
+
 def add(p1, p2):
     """
     Point addition in Jacobian coordinates.
@@ -74,13 +150,19 @@ def add(p1, p2):
     x1, y1, z1 = p1
     x2, y2, z2 = p2
 
-    z1z1 = (z1 * z1) % p
-    z2z2 = (z2 * z2) % p
-    u1 = (x1 * z2z2) % p
-    u2 = (x2 * z1z1) % p
+    # If either point is affine there is a much cheaper formula
+    if z2 == 1:
+        return add_mixed(p1, p2)
+    if z1 == 1:
+        return add_mixed(p2, p1)
+
+    z1z1 = fsqr(z1)
+    z2z2 = fsqr(z2)
+    u1 = fmul(x1, z2z2)
+    u2 = fmul(x2, z1z1)
     # s is the tangent at the two points
-    s1 = (y1 * z2 * z2z2) % p
-    s2 = (y2 * z1 * z1z1) % p
+    s1 = fmul(y1, fmul(z2, z2z2))
+    s2 = fmul(y2, fmul(z1, z1z1))
 
     # If u1 == u2 then the two points have the same x coordinates (in affine space)
     # In other words, either p1 == p2 or p1 == -p2
@@ -93,14 +175,14 @@ def add(p1, p2):
             # Different slope, same x value implies p1 == -p2. Sum is infinity.
             return None
 
-    H = (u2 - u1) % p
-    R = (s2 - s1) % p
-    HH = (H * H) % p
-    HHH = (H * HH) % p
-    V = u1 * HH
-    x3 = (R * R - HHH - 2 * V) % p
-    y3 = (R * (V - x3) - s1 * HHH) % p
-    z3 = (H * z1 * z2) % p
+    H = freduce(u2 - u1)
+    R = freduce(s2 - s1)
+    HH = fsqr(H)
+    HHH = fmul(H, HH)
+    V = fmul(u1, HH)
+    x3 = freduce(R * R - HHH - 2 * V)
+    y3 = freduce(R * (V - x3) - s1 * HHH)
+    z3 = fmul(H, fmul(z1, z2))
     return (x3, y3, z3)
 
 def multiply(u, point):
@@ -119,22 +201,144 @@ def multiply(u, point):
 
     return result
 
-def compute_result(u, P, v):
+def finish(steps):
     """
-    Compute u * P + v * G using Jacobian coordinates.
+    Run one of the step-wise (*_steps) generators below to completion and return its result
     """
-    # Convert affine to Jacobian
-    Pj = affine_to_jacobian(P)
+    try:
+        while True:
+            next(steps)
+    except StopIteration as e:
+        return e.value
 
-    # Compute scalar multiplications
-    uPj = multiply(u, Pj)
-    vG = multiply(v, G)
+def precompute_steps(point, width):
+    """
+    Step-wise form of precompute(). Yields after every point operation
+    """
+    columns = (BITS + width - 1) // width
+
+    # bases[j] = 2^(j * columns) * point
+    bases = [point]
+    for j in range(1, width):
+        q = bases[-1]
+        for _ in range(columns):
+            q = double(q)
+            yield
+        bases.append(q)
+
+    # Each entry is one addition away from an entry we have already computed
+    table = [None] * (1 << width)
+    for i in range(1, 1 << width):
+        j = 0
+        while not (i >> j) & 1:
+            j += 1
+        table[i] = add(table[i & ~(1 << j)], bases[j])
+        yield
 
-    # Add results
-    R = add(uPj, vG)
+    points = yield from batch_to_affine_steps(table[1:])
+    table = [None] + [affine_to_jacobian(point) for point in points]
+    return (width, columns, table)
 
-    # Convert back to affine
-    return jacobian_to_affine(R)
+def precompute(point, width):
+    """
+    Build a comb table for a fixed base point (Jacobian).
+    The scalar is split into `width` rows of `columns` bits. Entry i of the table is the sum of
+    2^(j * columns) * point for every bit j set in i, normalised so that Z = 1.
+    Returns (width, columns, table)
+    """
+    return finish(precompute_steps(point, width))
+
+def multi_multiply_steps(terms):
+    """
+    Step-wise form of multi_multiply(). Yields after every column
+    """
+    columns = 0
+    for _, comb in terms:
+        if comb[1] > columns:
+            columns = comb[1]
+    result = None # Point at infinity
+
+    for column in range(columns - 1, -1, -1):
+        if result != None:
+            result = double(result)
+        for u, (width, comb_columns, table) in terms:
+            # A table with fewer columns has nothing to contribute until we reach its top column
+            if column >= comb_columns:
+                continue
+            index = 0
+            for row in range(width - 1, -1, -1):
+                index = (index << 1) | ((u >> (row * comb_columns + column)) & 1)
+            if index:
+                result = add(result, table[index])
+        yield
+
+    return result
+
+def multi_multiply(terms):
+    """
+    Compute the sum of u * P for a sequence of (u, P_comb) pairs, where each P_comb is a table from
+    precompute(). This is Straus' trick: every term shares the same chain of doublings, so the
+    whole sum costs no more doublings than the table with the most columns.
+    """
+    return finish(multi_multiply_steps(terms))
+
+def g_comb():
+    """
+    Get the comb table for G, building it if it was not shipped with the code
+    """
+    global G_COMB
+    if G_COMB == None:
+        G_COMB = precompute(G, G_COMB_WIDTH)
+    return G_COMB
+
+def write_comb_module(filename, width = G_COMB_WIDTH):
+    """
+    Generate nist224p_g.py so that the table for G can be shipped rather than computed on the device.
+    Run this on a host: python -c "import nist224p; nist224p.write_comb_module('nist224p_g.py')"
+    """
+    comb_width, columns, table = precompute(G, width)
+    out = open(filename, "w", encoding="utf-8")
+    out.write('"""\nPrecomputed comb table for the NIST224p generator. Generated by nist224p.write_comb_module()\n"""\n\n')
+    out.write(f"G_COMB = ({comb_width}, {columns}, [\n    None,\n")
+    for x, y, z in table[1:]:
+        out.write(f"    ({hex(x)}, {hex(y)}, {z}),\n")
+    out.write("])\n")
+    out.close()
+
+def compute_result_steps(u, P, v, P_comb = None):
+    """
+    Step-wise form of compute_result_jacobian(), so that a caller can interleave it with other work
+    """
+    if P_comb == None:
+        # A width 1 comb is just the point itself, so this costs nothing to build
+        P_comb = (1, BITS, [None, affine_to_jacobian(P)])
+
+    # Both halves share one chain of doublings. G never changes, so use the fixed-base table for it
+    return (yield from multi_multiply_steps(((u, P_comb), (v, g_comb()))))
+
+def compute_result_jacobian(u, P, v, P_comb = None):
+    """
+    Compute u * P + v * G, leaving the result in Jacobian coordinates.
+    If P is used repeatedly, pass a table from precompute() for it as P_comb
+    """
+    return finish(compute_result_steps(u, P, v, P_comb))
+
+def compute_result(u, P, v, P_comb = None):
+    """
+    Compute u * P + v * G using Jacobian coordinates.
+    If there are several results to compute, use compute_result_jacobian and then batch_to_affine
+    to share the cost of the inversion
+    """
+    return jacobian_to_affine(compute_result_jacobian(u, P, v, P_comb))
+
+def compute_result_reference(u, P, v):
+    """
+    Compute u * P + v * G the straightforward way, with two independent multiplications.
+    Much slower than compute_result; kept to check it against
+    """
+    uPj = multiply(u, affine_to_jacobian(P))
+    vG = multiply(v, G)
+    return jacobian_to_affine(add(uPj, vG))
 
 def reduce(s):
     """
@@ -157,6 +361,34 @@ def is_on_curve(point):
         return (y * y * z) % p == (x * x * x + a * x * z * z + b * z * z * z) % p
     return False
 
+def self_test():
+    """
+    Check the fast paths against the straightforward ones: compute_result() (with and without a
+    table for P) and batch_to_affine() against compute_result_reference(), and the shipped table
+    for G against one built from scratch. Returns True if everything matches
+    """
+    ok = True
+    P = jacobian_to_affine(multiply(12345, G))
+    P_comb = precompute(affine_to_jacobian(P), 4)
+    scalars = [(1, 1), (2, n - 1), (reduce(123456789012345678901234567890), reduce(987654321098765432109876543210))]
+    jacobians = []
+    for u, v in scalars:
+        expected = compute_result_reference(u, P, v)
+        if compute_result(u, P, v) != expected or compute_result(u, P, v, P_comb) != expected:
+            print(f"compute_result is wrong for u={u}, v={v}")
+            ok = False
+        if not is_on_curve(expected):
+            print(f"compute_result_reference is off the curve for u={u}, v={v}")
+            ok = False
+        jacobians.append((compute_result_jacobian(u, P, v, P_comb), expected))
+    if batch_to_affine([j for j, _ in jacobians]) != [expected for _, expected in jacobians]:
+        print("batch_to_affine is wrong")
+        ok = False
+    if G_COMB != None and precompute(G, G_COMB[0]) != G_COMB:
+        print("The shipped table for G is wrong. Regenerate it with write_comb_module()")
+        ok = False
+    return ok
+
 def performance_test():
     start = time.ticks_us()
     u = reduce(123456789012345678901234567890)
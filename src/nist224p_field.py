@@ -0,0 +1,89 @@
+"""
+Arithmetic in the field underlying the NIST224p curve.
+
+p = 2^224 - 2^96 + 1 is a Solinas prime, so 2^224 = 2^96 - 1 (mod p). That lets us reduce with
+shifts, masks and additions instead of a big-integer division, which is slow on micropython.
+"""
+
+p = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF000000000000000000000001
+MASK = (1 << 224) - 1
+
+def reduce(x):
+    """
+    Reduce any integer (including negative ones, and products of two field elements) modulo p
+    """
+    if x < 0:
+        x = p - reduce(-x)
+        return 0 if x == p else x
+
+    # Fold everything above bit 224 back down. Each pass shrinks the high part by 128 bits
+    while x >> 224:
+        high = x >> 224
+        x = (x & MASK) + (high << 96) - high
+
+    # Now x < 2^224 < 2p
+    if x >= p:
+        x -= p
+    return x
+
+def mul(x, y):
+    """
+    Multiply two field elements
+    """
+    return reduce(x * y)
+
+def sqr(x):
+    """
+    Square a field element
+    """
+    return reduce(x * x)
+
+def sqr_n(x, n):
+    """
+    Square a field element n times
+    """
+    for _ in range(n):
+        x = reduce(x * x)
+    return x
+
+# How many squarings inv_steps() does between yields. About the cost of a point operation
+SQUARINGS_PER_STEP = 16
+
+def sqr_n_steps(x, n):
+    """
+    Step-wise form of sqr_n(). Yields after every SQUARINGS_PER_STEP squarings
+    """
+    while n > SQUARINGS_PER_STEP:
+        x = sqr_n(x, SQUARINGS_PER_STEP)
+        n -= SQUARINGS_PER_STEP
+        yield
+    return sqr_n(x, n)
+
+def inv_steps(x):
+    """
+    Step-wise form of inv(), for callers that cannot afford to do all 223 squarings in one go
+    """
+    x_1 = x
+    x_2 = mul(sqr(x_1), x_1)
+    x_3 = mul(sqr(x_2), x_1)
+    x_6 = mul(sqr_n(x_3, 3), x_3)
+    x_12 = mul(sqr_n(x_6, 6), x_6)
+    x_24 = mul((yield from sqr_n_steps(x_12, 12)), x_12)
+    x_48 = mul((yield from sqr_n_steps(x_24, 24)), x_24)
+    x_96 = mul((yield from sqr_n_steps(x_48, 48)), x_48)
+    x_120 = mul((yield from sqr_n_steps(x_96, 24)), x_24)
+    x_126 = mul(sqr_n(x_120, 6), x_6)
+    x_127 = mul(sqr(x_126), x_1)
+    return mul((yield from sqr_n_steps(x_127, 97)), x_96)
+
+def inv(x):
+    """
+    Compute the inverse of x as x^(p-2), using a fixed addition chain of 223 squarings and 11
+    multiplications. p - 2 = (2^127 - 1) * 2^97 + (2^96 - 1), and x_k below is x^(2^k - 1)
+    """
+    steps = inv_steps(x)
+    try:
+        while True:
+            next(steps)
+    except StopIteration as e:
+        return e.value
@@ -0,0 +1,38 @@
+"""
+Precomputed comb table for the NIST224p generator. Generated by nist224p.write_comb_module()
+"""
+
+G_COMB = (5, 45, [
+    None,
+    (0xb70e0cbd6bb4bf7f321390b94a03c1d356c21122343280d6115c1d21, 0xbd376388b5f723fb4c22dfe6cd4375a05a07476444d5819985007e34, 1),
+    (0x2699e2e9bbbbcc17a79ea4e7ed7fb0ec26f3cb78379f74c5b8ef1487, 0x43d04f56c0dbea41b32294106c795e46f4883e8d67f9338225fed87e, 1),
+    (0x5713a33d0117a27c484c0e1c6e13fe192699fd1efad3d23dd0b8f9e0, 0xd76c43d325c214c6ca6ce3e44c2a05933443c5bf580fedaa8f5c169f, 1),
+    (0xdacec5fd35fa3163c13458939d886694a99ee0256c35feeb56ca6976, 0xc3f40636632a04bba870efa0ab889b492c9f797a6576a65258f3f1e9, 1),
+    (0xcc330c2fd15f544cb664bb1b65edeff878564998a342a5c81e985ac3, 0x5d830eb6ab7871c0a3bd6d84539e957d7d41f2ee6d8ff082ecb79fa, 1),
+    (0xeeec9267d632ab0e75e686127cd9452d64c4d4e39aa4e301c95c8450, 0xfc252a1151f0cb95023211667e43d14937b8c144c150f9da5d62ae6a, 1),
+    (0xc5392ed1ca4c2c198238dff064e791c167a65bb4c2c2bbe69a7479ad, 0xae1fa59b982c0ce735714dba426b92f4f88bf61476025bae4e783699, 1),
+    (0x6f302c91a148e4804f8b393672103b2ebf223df47aee739b5c6787d0, 0x86851d14bc3c4e06dd6da2277cfef8a02202c320017700f777b0157d, 1),
+    (0x5580e14345dbfcaf620924e8610e0fc65ab17405b751f25bdf4b1caf, 0x586fd97aa3866b7ace5b83efa5af0761762a224d8cfe5c3adfe823c, 1),
+    (0xee955e6560ad162bce907d3f158fdabd7fcd2eff0a5261bd1004e1f7, 0x3d7756d66ecd683296c22fbd39618b84109ed00220da2cd447d2561c, 1),
+    (0x78db49b1eee48a55e69b4796a2b710908db459bcf1b066d13c0cd359, 0xf01b839b3d79820ecdd3d3af8d40beebb783b91048dfb3ffdeed9741, 1),
+    (0x879218cf9dcef55b6ec992b1edf78b72cb9f788a4b137f28661df0d8, 0x716e4a91731e49ba77858653e2165602bca149f774c8b81861519be1, 1),
+    (0x27570015ff4a11d0ed0aefe1718e9689e0e53680fc5631d354bb223f, 0x79807394923713ce804444028fedd7416b70e390856e9b64f73dca13, 1),
+    (0xea97fe839d00b196ba37e6b19978fb94105a7a665fe472047901b347, 0x1ce4e6848e077401d798b67564efc34299b7bb035ed26b9fb59422b1, 1),
+    (0xf7c6ce04b6deb38191cdf0ba3f7824c44788356d581c0f317d704db7, 0xf4f0bc9e3d24f443ce2181ae02586e0c0e7c5ed5108f00d2e82d9ce9, 1),
+    (0x64c62dfbb6cf1f9395061a44bfb2caf72068eddf4fe9831e54a326ea, 0xf179611ace03ed87118de7ecf88d14aedb3068323100304a01586916, 1),
+    (0x2b1933e0bd5c77faa90ce7f517352b382bf46789cf8a8f4a74c210d6, 0xc15ef4e145a573c37ac9009a1a01ec16a1bc13e0bee9e15322963ee7, 1),
+    (0x69d24e70994c8ab42af0ce4322fe8be7fba23d570d4225e6e21f99ea, 0xf21e749399b1bac7ad7404ffa0cfa06c5c9d2dee6ba6e6790e94a786, 1),
+    (0xb3902d03f965648805a28473827e2a6105094277d02b3032d9d695a8, 0x49cf4634581f18798e28c3d36efbafb478acc10f797c8055852ee70a, 1),
+    (0x4b1622f0d0090d0ebf419846328a68ed26242c6e5459b6682542b9df, 0xbfd261bdca3cc19188112fcc24017e0467ce12de3a668ae803184dc1, 1),
+    (0xcf628c7b3cd77e89039d2a77745707b61193a9fafa4383466ca85f63, 0xb8430abc25283a2e24380afc7cb3c757bc48b9519e84facc59132c44, 1),
+    (0x600e7bafb5c615dd979bd44cdd8961b15431d3e9f4c3fe1c05f54a76, 0x3762d74a88b12874e5e59a04615ebc691e9a0222a8d1782212e63139, 1),
+    (0x5af0106bcbf4059a2d4d1fe83575804a1d45dbf3e13c70eec1ab2559, 0x1f714294f8a2444e77d60b590d14a156d127dcec7bc38615dce19535, 1),
+    (0xc9798cc4f88183a134e496566b3af5f2398a549571b848d8fc65847c, 0x27fe37a4f6178a912194539d13f96daee86a53c7c275947e03a95b32, 1),
+    (0xd6799558468df55bdd86031bc53b9ebcdbcbef96fe7b2fc8b0b28630, 0x8bab8b80be8bfd6171df1f764040a7ee06fb3eb539074f9bda143284, 1),
+    (0xe8f21c3c4be6fdc211f2eabd400a40b071b4dd9f8dfe248010e4e9b6, 0x23368f3be5be09978cfefcc42c236fccfffb471c557c786e70afed1, 1),
+    (0x1fdd33ca0a2189cc34f7c6412f13bb77a84858e65eb09fbcb4b334c9, 0x3cfd760bd2621603530a2367e8dddf4a726ef783cd0b10f2a4ef81cc, 1),
+    (0x94cb5b19539f8628a6cb58c742849d05a7e3a1c5776c4bf51339a32a, 0xf9c5821b7eafd2b80d17ccd1a40d498ae028074c5ec1135ea3224664, 1),
+    (0xb12c38334ecd2463c6b0c0d1dea06cb0d7e12a0307be18a0faa114cb, 0x7b5b184304eb0220d2f399ca7bf745b6a29f9709c3acfe0c207dcdee, 1),
+    (0x4bff8e1e13e0bf9d291b390ad4fcf14c83da3ff450421ed65af05692, 0xab4dfa67fcd7e8a63c42c524f381ef17d9134aa93d62f91ae9f4bbc1, 1),
+    (0x61dc584963f653f2c128f4001a0e1790d6b5d37dd3fdea609177dd2b, 0xca27fff47933301ba40041a7a6bacb11da067fd0455fbdf1fb0120a8, 1),
+])
@@ -0,0 +1,79 @@
+"""
+A table of advertised prefixes computed ahead of time on a host (see tools/precompute.py), so that
+the puck can read the prefix for a key period instead of doing the curve maths for it.
+
+The file is:
+    header:  magic "SPPT", version (1 byte), key count (1 byte), periods per key (4 bytes)
+    per key: CRC32 of the public point (4 bytes), time the first period is valid from (4 bytes)
+    records: for each key in turn, `periods` 6-byte prefixes, one per 15 minute period
+All integers are big-endian.
+"""
+import struct
+from binascii import crc32
+import log
+
+MAGIC = b"SPPT"
+VERSION = 1
+HEADER = ">4sBBI"
+KEY_ENTRY = ">II"
+PREFIX_SIZE = 6
+PERIOD = 15 * 60
+
+def key_id(point):
+    """
+    Identify a key in the table by its public point (x and y, as stored in key.point)
+    """
+    return crc32(point)
+
+def write(filename, entries, periods):
+    """
+    Write a table. entries is a list of (public point, time the first period is valid from, prefixes)
+    where prefixes is a list of `periods` 48-bit prefixes
+    """
+    out = open(filename, "wb")
+    out.write(struct.pack(HEADER, MAGIC, VERSION, len(entries), periods))
+    for point, start, _ in entries:
+        out.write(struct.pack(KEY_ENTRY, key_id(point), start))
+    for _, _, prefixes in entries:
+        for prefix in prefixes:
+            out.write(prefix.to_bytes(PREFIX_SIZE, "big"))
+    out.close()
+
+class PrefixTable:
+    def __init__(self, file):
+        self.file = file
+        magic, version, key_count, self.periods = struct.unpack(HEADER, file.read(struct.calcsize(HEADER)))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a prefix table")
+        # key id -> (position of the key in the table, time the first period is valid from)
+        self.starts = {}
+        for index in range(key_count):
+            id, start = struct.unpack(KEY_ENTRY, file.read(struct.calcsize(KEY_ENTRY)))
+            self.starts[id] = (index, start)
+        self.records = struct.calcsize(HEADER) + key_count * struct.calcsize(KEY_ENTRY)
+
+    @staticmethod
+    def open(filename):
+        """
+        Open a table, or return None if there isn't a usable one
+        """
+        try:
+            return PrefixTable(open(filename, "rb"))
+        except (OSError, ValueError) as e:
+            log.info("No prefix table: {}", e)
+            return None
+
+    def lookup(self, point, t_i):
+        """
+        Get the prefix for the period of a key that is valid from t_i, or None if the table does
+        not cover it
+        """
+        entry = self.starts.get(key_id(point))
+        if entry == None:
+            return None
+        index, start = entry
+        period = (t_i - start) // PERIOD
+        if period < 0 or period >= self.periods or start + period * PERIOD != t_i:
+            return None
+        self.file.seek(self.records + (index * self.periods + period) * PREFIX_SIZE)
+        return int.from_bytes(self.file.read(PREFIX_SIZE), "big")
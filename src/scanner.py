@@ -1,27 +1,134 @@
 """
 Scan for bluetooth devices and call the callback if we find an Apple device reporting it is paired
+
+Scanning flat out is only worth it while a switch is waiting for a tag. The rest of the time the
+scanner drops to a low duty cycle, which leaves the CPU for the key maths and saves power. Call
+set_active() whenever that changes; the scan is restarted with the new settings.
 """
+import asyncio
 import aioble
-from airtag import handle_airtag
+import airtag
+from airtag import handle_airtag, airtag_detected, UNKNOWN
+from address_cache import AddressCache
+import metrics
+import log
 
 APPLE = 0x004c
 STATUS_PAIRED = 0x12
+MANUFACTURER_DATA = 0xff
+
+# Addresses rotate at most every 15 minutes, and the cache is also flushed whenever a key window moves
+address_cache = AddressCache(64, 60_000, "scanner.address_cache")
+# Scan (interval, window) in microseconds for when a switch is waiting for a tag, and for when none
+# is. Set IDLE_SCAN to None to stop scanning altogether when nothing is waiting
+ACTIVE_SCAN = (11250, 11250)
+IDLE_SCAN = (1280000, 11250)
+# Seconds to wait before starting the scan again if it stops by itself
+SCAN_RETRY = 2
+
+active = False
+# Set when active changes. This can happen in a timer callback, so it has to be a ThreadSafeFlag
+try:
+    changed = asyncio.ThreadSafeFlag()
+except AttributeError:
+    # CPython, for tools/replay.py
+    changed = asyncio.Event()
+
+RESULTS = metrics.counter("scanner.results")
+APPLE_DEVICES = metrics.counter("scanner.apple_devices")
+SCANS = metrics.counter("scanner.scans")
+
+# If this is set to a capture.Capture, everything the scanner hears is recorded to it
+capture = None
 
 def handle_device(result, then):
-    for manufacturer_id, manufacturer_data in result.manufacturer():
-        if manufacturer_id == APPLE:
-            #print(f"Found apple device at distance {result.rssi} with {manufacturer_data}")
-            if manufacturer_data[0] == STATUS_PAIRED:
+    RESULTS.add()
+    address = result.device.addr
+    decision = address_cache.get(address, airtag.window_generation)
+    if decision != None:
+        if decision != UNKNOWN:
+            airtag_detected(decision, result.rssi, then)
+        return
+
+    # Walk the AD structures in place rather than using result.manufacturer(), which slices out a
+    # copy of every field. Each structure is a length byte, a type byte and then length - 1 bytes
+    adv_data = result.adv_data
+    decision = UNKNOWN
+    i = 0
+    while i + 4 < len(adv_data):
+        length = adv_data[i]
+        if length == 0:
+            break
+        # A manufacturer structure needs the company ID and the status type before it is any use
+        if length >= 4 and adv_data[i + 1] == MANUFACTURER_DATA and (adv_data[i + 2] | (adv_data[i + 3] << 8)) == APPLE:
+            #print(f"Found apple device at distance {result.rssi} with {adv_data}")
+            if adv_data[i + 4] == STATUS_PAIRED:
                 #print("Found apple device")
                 # We found an Apple device
-                # Drop the first two bytes. The code expects to see the body of the advertisement
-                # adv_data is the header+body, and manufacturer_data has part of the header removed.
-                # Annoying
-                handle_airtag(result.device.addr, result.adv_data[2:], result.rssi, then)
+                # The code expects to see the body of the manufacturer data, which starts with the
+                # company ID two bytes into the structure
+                APPLE_DEVICES.add()
+                decision = handle_airtag(address, adv_data, i + 2, result.rssi, then, i + 1 + length)
+                break
+        i += length + 1
+    address_cache.put(address, decision)
+
+def set_active(now_active):
+    """
+    Say whether anything is waiting for a tag
+    """
+    global active
+    if now_active != active:
+        active = now_active
+        changed.set()
+
+async def scan(settings, then):
+    interval_us, window_us = settings
+    SCANS.add()
+    log.info("Starting continuous BLE scan with a {}us window every {}us...", window_us, interval_us)
+    try:
+        async with aioble.scan(duration_ms=0, interval_us=interval_us, window_us=window_us) as scanner:  # 0 means scan indefinitely
+            async for result in scanner:
+                if capture != None:
+                    capture.record(result)
+                handle_device(result, then)
+    finally:
+        # Wake up scan_devices(), in case the scan stopped by itself
+        changed.set()
 
 async def scan_devices(then):
-    print("Starting continuous BLE scan...")
-    async with aioble.scan(duration_ms=0, interval_us=11250, window_us=11250) as scanner:  # 0 means scan indefinitely
-        async for result in scanner:
-            handle_device(result, then)
-    
\ No newline at end of file
+    """
+    Scan for as long as this task runs. Cancel it to stop
+    """
+    task = None
+    try:
+        while True:
+            settings = ACTIVE_SCAN if active else IDLE_SCAN
+            task = None
+            if settings != None:
+                task = asyncio.create_task(scan(settings, then))
+            else:
+                log.info("Nothing is waiting for a tag. Scanning paused")
+            await changed.wait()
+            if task != None:
+                if task.done():
+                    # The scan ended by itself (or the BLE stack failed), rather than because
+                    # something changed. Give it a moment and start again
+                    try:
+                        await task
+                        log.warning("Scan stopped. Restarting it in {}s", SCAN_RETRY)
+                    except Exception as e:
+                        log.error("Scan failed: {!r}. Restarting it in {}s", e, SCAN_RETRY)
+                    changed.clear()
+                    await asyncio.sleep(SCAN_RETRY)
+                    continue
+                # Stop the scan cleanly: leaving the async with in scan() stops the radio
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+            changed.clear()
+    finally:
+        if task != None and not task.done():
+            task.cancel()
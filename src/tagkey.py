@@ -0,0 +1,64 @@
+"""
+The state we keep for each AirTag key.
+
+There is one of these per tag for as long as the puck runs, so it is kept compact: fixed slots
+rather than a dict, and the advertised window is a ring buffer in a single preallocated bytearray
+(6 bytes per prefix) with the matching period times in an array, rather than deques of objects.
+"""
+from array import array
+
+PREFIX_SIZE = 6
+ENDIANNESS = "big"
+
+class TagKey:
+    __slots__ = ('index', 'time', 'shared_key', 'p_0', 'p_0_comb', 'point', 'name', 'trace', 'trace_time',
+                 'window_size', 'prefixes', 'times', 'first', 'count', 'damaged')
+
+    def __init__(self, t_0, shared_key, point, name, window_size):
+        self.index = 0
+        self.time = t_0
+        self.shared_key = shared_key
+        # Micropython doesnt have ecdsa support so I cannot just construct a Point.
+        # Store p_0 as a tuple. We know which curve it is.
+        self.p_0 = (int.from_bytes(point[:28], ENDIANNESS), int.from_bytes(point[28:], ENDIANNESS))
+        self.p_0_comb = None
+        # The public key: x and y, 28 bytes each
+        self.point = point
+        self.name = name
+        self.trace = shared_key
+        self.trace_time = t_0
+        # The raw record, if this only holds the place of one that was damaged in the keys file
+        self.damaged = None
+
+        # The advertised window. The oldest entry is at position `first`, and there are `count` of them
+        self.window_size = window_size
+        self.prefixes = bytearray(window_size * PREFIX_SIZE)
+        self.times = array('I', [0] * window_size)
+        self.first = 0
+        self.count = 0
+
+    def prefix(self, i):
+        """
+        Get the i-th oldest prefix in the window
+        """
+        position = ((self.first + i) % self.window_size) * PREFIX_SIZE
+        return int.from_bytes(self.prefixes[position:position + PREFIX_SIZE], ENDIANNESS)
+
+    def period_time(self, i):
+        """
+        Get the time the i-th oldest prefix in the window is valid from
+        """
+        return self.times[(self.first + i) % self.window_size]
+
+    def push(self, t_i, prefix):
+        """
+        Add a prefix to the end of the window, dropping the oldest one if the window is full
+        """
+        if self.count == self.window_size:
+            slot = self.first
+            self.first = (self.first + 1) % self.window_size
+        else:
+            slot = (self.first + self.count) % self.window_size
+            self.count += 1
+        self.prefixes[slot * PREFIX_SIZE:(slot + 1) * PREFIX_SIZE] = prefix.to_bytes(PREFIX_SIZE, ENDIANNESS)
+        self.times[slot] = t_i
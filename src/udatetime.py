@@ -22,7 +22,7 @@ def iso8601_to_timestamp(sync_time):
     dt_0 = (year, month, day, hour, minute, second, 0, 0, 0)
 
     # Convert to Unix timestamp
-    t_0 = mktime(dt_0)
+    t_0 = int(mktime(dt_0))
 
     return t_0
 
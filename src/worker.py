@@ -0,0 +1,90 @@
+"""
+Run CPU-heavy jobs (the key derivation and curve maths) away from the thread running the event loop.
+
+On the pico the jobs run on the second core, started with _thread. On a host they run in a process
+pool, so that many keys can be worked on at once. Either way the caller just does
+`result = await executor.run(function, *args)`.
+
+Jobs run concurrently with the event loop, so they must not touch shared state: pass everything in
+as arguments and hand everything back in the result.
+"""
+import sys
+import asyncio
+
+class Job:
+    def __init__(self, function, args):
+        self.function = function
+        self.args = args
+        self.result = None
+        self.error = None
+        # Set from the worker thread when the job is finished
+        self.done = asyncio.ThreadSafeFlag()
+
+
+class CoreExecutor:
+    """
+    Runs jobs one at a time on the second core
+    """
+    def __init__(self):
+        import _thread
+        self.queue = []
+        self.lock = _thread.allocate_lock()
+        # Held while there is nothing to do. Posting a job releases it
+        self.wake = _thread.allocate_lock()
+        self.wake.acquire()
+        _thread.start_new_thread(self.__work, ())
+
+    def __work(self):
+        while True:
+            self.wake.acquire()
+            while True:
+                with self.lock:
+                    if len(self.queue) == 0:
+                        break
+                    job = self.queue.pop(0)
+                try:
+                    job.result = job.function(*job.args)
+                except Exception as e:
+                    job.error = e
+                job.done.set()
+
+    async def run(self, function, *args):
+        job = Job(function, args)
+        with self.lock:
+            self.queue.append(job)
+        try:
+            self.wake.release()
+        except RuntimeError:
+            # The worker is already awake, and will find the job before it goes back to sleep
+            pass
+        await job.done.wait()
+        if job.error != None:
+            raise job.error
+        return job.result
+
+
+class PoolExecutor:
+    """
+    Runs jobs in a pool of processes (or threads) on a host
+    """
+    def __init__(self, workers = None, processes = True):
+        import concurrent.futures
+        if processes:
+            self.pool = concurrent.futures.ProcessPoolExecutor(workers)
+        else:
+            self.pool = concurrent.futures.ThreadPoolExecutor(workers)
+
+    async def run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.pool, function, *args)
+
+    def close(self):
+        self.pool.shutdown()
+
+
+def get_executor():
+    """
+    Get the right executor for wherever we are running
+    """
+    if sys.implementation.name == "micropython":
+        return CoreExecutor()
+    return PoolExecutor()
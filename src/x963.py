@@ -3,19 +3,44 @@ Implements the X9.63 key derivation function with SHA-256
 """
 import hashlib
 
-def kdf(shared_secret: bytes, key_length: int, other_info: bytes = b''):
-    """Implements ANSI X9.63 KDF with SHA-256"""
-    key = b''
-    counter = 1
+DIGEST_SIZE = 32
 
-    while len(key) < key_length:
-        # Concatenate shared_secret + counter + otherInfo
-        data = shared_secret + counter.to_bytes(4, "big") + other_info
+def kdf_into(out, shared_secret: bytes, other_info: bytes = b''):
+    """
+    Fill the buffer out with ANSI X9.63 KDF output with SHA-256, so that a loop can reuse the same
+    buffer instead of allocating a new key every time
+    """
+    # shared_secret + counter + otherInfo is built once, and only the counter changes from block
+    # to block. The counter is 4 bytes big-endian, and we never need more than 255 blocks
+    n = len(shared_secret)
+    data = bytearray(n + 4 + len(other_info))
+    data[:n] = shared_secret
+    data[n + 4:] = other_info
 
-        # Apply SHA-256
-        key += hashlib.sha256(data).digest()
+    length = len(out)
+    position = 0
+    counter = 1
+    while position < length:
+        data[n + 3] = counter
+        block = hashlib.sha256(data).digest()
 
+        # the KDF allows us to specify how much of the data is actually needed
+        end = position + DIGEST_SIZE
+        if end <= length:
+            out[position:end] = block
+        else:
+            out[position:] = block[:length - position]
+        position = end
         counter += 1
+    return out
 
-    # the KDF allows us to specify how much of the data is actually needed
-    return key[:key_length]
+def kdf(shared_secret: bytes, key_length: int, other_info: bytes = b''):
+    """Implements ANSI X9.63 KDF with SHA-256"""
+    if key_length == DIGEST_SIZE:
+        # One block is the whole key, so there is nothing to copy. This is what the key chain does
+        # every period
+        h = hashlib.sha256(shared_secret)
+        h.update(b"\x00\x00\x00\x01")
+        h.update(other_info)
+        return h.digest()
+    return bytes(kdf_into(bytearray(key_length), shared_secret, other_info))
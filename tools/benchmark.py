@@ -0,0 +1,280 @@
+"""
+Benchmarks for the parts of the puck that are worth making faster: the curve maths, the KDF, rolling
+the keys and handling advertisements.
+
+On a host:
+    python tools/benchmark.py [--save FILE] [--compare FILE] [benchmark ...]
+On the puck (with the code already installed), which saves to and compares against `benchmarks`:
+    mpremote run tools/benchmark.py
+
+The curve maths is checked against the reference implementation first (nist224p.self_test()), since
+a fast answer is no use if it is wrong.
+
+For each benchmark this reports operations per second and how much memory was allocated. On the
+puck that is the bytes allocated per operation, which is what makes the GC run. CPython does not
+keep a count like that, so there it is the peak memory used during the run instead.
+"""
+import sys
+import json
+import gc
+
+try:
+    import host
+except ImportError:
+    # On the puck, where everything is already in place
+    pass
+
+from time import time, ticks_us, ticks_diff
+import nist224p
+import x963
+import airtag
+import scanner
+import log
+
+ON_DEVICE = sys.implementation.name == "micropython"
+# The puck is a few hundred times slower, so it does less of everything
+SCALE = 1 if ON_DEVICE else 20
+RESULTS = "benchmarks"
+
+def quiet():
+    """
+    Stop the log while things are being timed
+    """
+    global log_level
+    log_level = log.level
+    log.level = log.ERROR + 1
+
+def loud():
+    log.level = log_level
+
+def make_point(k):
+    x, y = nist224p.jacobian_to_affine(nist224p.multiply(k, nist224p.G))
+    return x.to_bytes(28, "big") + y.to_bytes(28, "big")
+
+def make_keys(count, t_0):
+    """
+    Replace airtag.keys with count made-up keys, all synced at t_0
+    """
+    airtag.keys.clear()
+    airtag.prefix_index.clear()
+    for i in range(count):
+        key = airtag.make_key(int(t_0), bytes([i + 1]) * 32, make_point(12345 + i), f"Tag {i}")
+        key.index = i
+        airtag.keys.append(key)
+
+def advertisement(prefix):
+    """
+    Build (address, advertising data) for an AirTag advertising prefix, with a full key
+    """
+    address = bytearray((prefix >> 8 * (5 - i)) & 0xff for i in range(6))
+    special_bits = address[0] >> 6
+    address[0] |= 0b11000000
+    # Flags, then the Apple manufacturer data: company ID, status type, length 25 and the body
+    # status, the rest of the key (which we ignore), the special bits and the hint
+    data = bytes([0x02, 0x01, 0x06, 0x1e, 0xff, 0x4c, 0x00, 0x12, 25]) + bytes(23) + bytes([special_bits, 0])
+    return bytes(address), data
+
+
+class Result:
+    """
+    A made-up scan result, with the parts of aioble's that the scanner uses
+    """
+    class Device:
+        def __init__(self, addr):
+            self.addr = addr
+
+    def __init__(self, address, adv_data, rssi):
+        self.device = Result.Device(address)
+        self.adv_data = adv_data
+        self.rssi = rssi
+
+
+def bench_multiply():
+    k = nist224p.reduce(123456789012345678901234567890)
+    return lambda: nist224p.multiply(k, nist224p.G), 1
+
+def bench_compute_result():
+    u = nist224p.reduce(123456789012345678901234567890)
+    v = nist224p.reduce(987654321098765432109876543210)
+    p_0 = nist224p.jacobian_to_affine(nist224p.multiply(12345, nist224p.G))
+    comb = nist224p.precompute(nist224p.affine_to_jacobian(p_0), airtag.KEY_COMB_WIDTH)
+    return lambda: nist224p.compute_result(u, p_0, v, comb), 1
+
+def bench_kdf_update():
+    sk = bytes(range(32))
+    return lambda: x963.kdf(sk, 32, b"update"), 1
+
+def bench_kdf_diversify():
+    sk = bytes(range(32))
+    at = bytearray(airtag.AT_SIZE)
+    return lambda: x963.kdf_into(at, sk, b"diversify"), 1
+
+def bench_rehydrate():
+    days = 1 if ON_DEVICE else 30
+    def run():
+        make_keys(1, time() - days * 86400)
+        airtag.rehydrate_keys()
+    make_keys(1, time() - days * 86400)
+    # rehydrate_keys() stops 4 hours short of now
+    return run, airtag.periods_until(airtag.keys[0], time() - 4 * 60 * 60)
+
+def bench_update_keys():
+    count = 2 if ON_DEVICE else 8
+    def run():
+        make_keys(count, time() - 4 * 60 * 60)
+        airtag.update_keys()
+    # Each key needs its whole window, which is the 4 hours of the catch-up plus half of the window
+    return run, count * (16 + airtag.WINDOW_SIZE // 2)
+
+def bench_handle_airtag():
+    make_keys(2, time() - 60 * 60)
+    airtag.update_keys()
+    ours = [advertisement(key.prefix(i)) for key in airtag.keys for i in range(key.count)]
+    others = [advertisement(0x123456789a00 + i) for i in range(64)]
+    adverts = others + ours[:4]
+    def run():
+        for address, data in adverts:
+            airtag.handle_airtag(address, data, 5, -50, lambda name, index, rssi: None)
+    return run, len(adverts)
+
+def bench_handle_device():
+    make_keys(2, time() - 60 * 60)
+    airtag.update_keys()
+    ours = [advertisement(key.prefix(i)) for key in airtag.keys for i in range(key.count)]
+    others = [advertisement(0x123456789a00 + i) for i in range(64)]
+    results = [Result(address, data, -50) for address, data in others + ours[:4]]
+    def run():
+        for result in results:
+            scanner.handle_device(result, lambda name, index, rssi: None)
+    return run, len(results)
+
+# name: (set up the benchmark, how many times to run it)
+BENCHMARKS = {
+    "multiply": (bench_multiply, 2 * SCALE),
+    "compute_result": (bench_compute_result, 2 * SCALE),
+    "kdf_update": (bench_kdf_update, 100 * SCALE),
+    "kdf_diversify": (bench_kdf_diversify, 100 * SCALE),
+    "rehydrate_keys": (bench_rehydrate, 1),
+    "update_keys": (bench_update_keys, 1),
+    "handle_airtag": (bench_handle_airtag, 10 * SCALE),
+    "handle_device": (bench_handle_device, 10 * SCALE),
+}
+
+def timed(run, repeat):
+    start = ticks_us()
+    for _ in range(repeat):
+        run()
+    return ticks_diff(ticks_us(), start)
+
+def measure(run, repeat):
+    """
+    Time run() repeat times. Returns (microseconds, memory allocated)
+    """
+    gc.collect()
+    if ON_DEVICE:
+        # With the GC off, everything allocated is still counted at the end
+        gc.disable()
+        before = gc.mem_alloc()
+        try:
+            elapsed = timed(run, repeat)
+        finally:
+            allocated = gc.mem_alloc() - before
+            gc.enable()
+        return elapsed, allocated
+
+    # tracemalloc slows everything down, so the memory is measured in a second run
+    import tracemalloc
+    elapsed = timed(run, repeat)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        timed(run, repeat)
+    finally:
+        allocated = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return elapsed, allocated
+
+def run_benchmarks(names):
+    results = {}
+    quiet()
+    try:
+        for name in names:
+            setup, repeat = BENCHMARKS[name]
+            run, ops = setup()
+            elapsed, allocated = measure(run, repeat)
+            ops *= repeat
+            result = {"ops_per_sec": ops * 1000000 / max(elapsed, 1)}
+            if ON_DEVICE:
+                result["bytes_per_op"] = allocated / ops
+            else:
+                result["peak_bytes"] = allocated
+            results[name] = result
+            print(f"{name:16} {describe(result)}")
+    finally:
+        loud()
+    return results
+
+def describe(result):
+    text = f"{result['ops_per_sec']:12.1f} ops/s"
+    if "bytes_per_op" in result:
+        text += f" {result['bytes_per_op']:10.1f} bytes/op"
+    if "peak_bytes" in result:
+        text += f" {result['peak_bytes']:10d} bytes peak"
+    return text
+
+def compare(results, filename):
+    """
+    Print how results compare with the ones saved in filename
+    """
+    try:
+        with open(filename) as file:
+            previous = json.load(file)["results"]
+    except OSError:
+        print(f"No previous results in {filename}")
+        return
+    print(f"Compared with {filename}:")
+    for name, result in results.items():
+        old = previous.get(name)
+        if old == None:
+            continue
+        change = 100 * (result["ops_per_sec"] / old["ops_per_sec"] - 1)
+        print(f"{name:16} {change:+7.1f}% ops/s")
+
+def save(results, filename):
+    with open(filename, "w") as file:
+        json.dump({"platform": sys.implementation.name, "time": time(), "results": results}, file)
+    print(f"Saved results to {filename}")
+
+def main(args):
+    save_to = None
+    compare_with = None
+    names = []
+    while len(args) > 0:
+        arg = args.pop(0)
+        if arg == "--save":
+            save_to = args.pop(0)
+        elif arg == "--compare":
+            compare_with = args.pop(0)
+        elif arg in BENCHMARKS:
+            names.append(arg)
+        else:
+            print(f"Unknown benchmark {arg}. Choose from {', '.join(BENCHMARKS)}")
+            return
+    if ON_DEVICE:
+        # mpremote run cannot pass arguments
+        save_to = RESULTS
+        compare_with = RESULTS
+    if len(names) == 0:
+        names = list(BENCHMARKS)
+
+    if not nist224p.self_test():
+        print("The curve maths does not match the reference. Not benchmarking it")
+        return
+    results = run_benchmarks(names)
+    if compare_with != None:
+        compare(results, compare_with)
+    if save_to != None:
+        save(results, save_to)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
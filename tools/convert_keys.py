@@ -0,0 +1,22 @@
+"""
+Convert a text keys file to the binary format
+
+    python tools/convert_keys.py config/keys config/keys.bin
+
+The puck reads either format, and rewrites its keys in the binary format whenever it stashes them.
+"""
+import argparse
+
+import host
+import keyfile
+
+def main():
+    parser = argparse.ArgumentParser(description = "Convert a text keys file to the binary format")
+    parser.add_argument("input", help = "text keys file")
+    parser.add_argument("output", help = "where to write the binary keys file")
+    args = parser.parse_args()
+    keyfile.convert(args.input, args.output)
+    print(f"Converted {args.input} to {args.output}")
+
+if __name__ == "__main__":
+    main()
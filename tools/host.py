@@ -0,0 +1,30 @@
+"""
+Lets the puck's modules run under CPython, for the tools in this directory.
+Import this before importing anything from src.
+"""
+import os
+import sys
+import time
+import types
+
+# The puck keeps its clock in UTC, and udatetime relies on mktime/gmtime agreeing about that
+os.environ["TZ"] = "UTC"
+time.tzset()
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+# Micropython's wrapping tick counters
+TICKS_PERIOD = 1 << 30
+
+if not hasattr(time, "ticks_ms"):
+    time.ticks_ms = lambda: int(time.monotonic() * 1000) % TICKS_PERIOD
+    time.ticks_us = lambda: int(time.monotonic() * 1000000) % TICKS_PERIOD
+    time.ticks_add = lambda ticks, delta: (ticks + delta) % TICKS_PERIOD
+    time.ticks_diff = lambda end, start: ((end - start + TICKS_PERIOD // 2) % TICKS_PERIOD) - TICKS_PERIOD // 2
+
+# There is no radio or pins on a host. These are just enough to import the modules that use them
+for name in ("aioble", "machine"):
+    try:
+        __import__(name)
+    except ImportError:
+        sys.modules[name] = types.ModuleType(name)
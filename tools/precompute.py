@@ -0,0 +1,58 @@
+"""
+Precompute the advertised prefixes for every key in a keys file, so that the puck can look them up
+instead of doing the curve maths itself.
+
+    python tools/precompute.py config/keys config/prefixes --days 30
+
+Copy the output to the puck as `prefixes` (install.sh does this if config/prefixes exists). The
+puck falls back to computing prefixes itself for any period the table does not cover.
+"""
+import argparse
+import asyncio
+import time
+
+import host
+import airtag
+import prefix_table
+from udatetime import iso8601_to_timestamp, timestamp_to_iso8601
+from worker import PoolExecutor
+
+async def derive(executor, key, start, periods):
+    """
+    Work out the prefixes for one key for `periods` periods from `start`
+    """
+    rolled = airtag.periods_until(key, start)
+    shared_key = await executor.run(airtag.advance_chain, key.shared_key, rolled)
+    first = int(key.time) + (rolled + 1) * 15 * 60
+    _, prefixes, _ = await executor.run(airtag.derive_window, shared_key, key.p_0, None, periods)
+    print(f"{key.name}: {periods} prefixes from {timestamp_to_iso8601(first)}")
+    return (key.point, first, prefixes)
+
+async def precompute(keys, start, periods, workers):
+    executor = PoolExecutor(workers)
+    try:
+        return await asyncio.gather(*[derive(executor, key, start, periods) for key in keys])
+    finally:
+        executor.close()
+
+def main():
+    parser = argparse.ArgumentParser(description = "Precompute advertised prefixes for the puck")
+    parser.add_argument("keys", help = "keys file, as copied to the puck")
+    parser.add_argument("output", help = "where to write the prefix table")
+    parser.add_argument("--days", type = int, default = 30, help = "how many days of prefixes to compute")
+    parser.add_argument("--start", help = "ISO-8601 time to start from (default: now)")
+    parser.add_argument("--workers", type = int, default = None, help = "number of processes to use")
+    args = parser.parse_args()
+
+    start = iso8601_to_timestamp(args.start) if args.start else int(time.time())
+    # The puck rehydrates keys to 4 hours ago, and derives prefixes forwards from there
+    start -= 4 * 60 * 60
+    periods = args.days * 24 * 4
+
+    airtag.load_keys(args.keys)
+    entries = asyncio.run(precompute(airtag.keys, start, periods, args.workers))
+    prefix_table.write(args.output, entries, periods)
+    print(f"Wrote {len(entries)} keys to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Replay a log recorded by the puck's scanner (see src/capture.py) through the real detection path:
+scanner.handle_device, airtag.handle_airtag and on to a callback like main.airtag_found.
+
+    python tools/replay.py scan.log --keys config/keys [--fast] [--verbose]
+
+By default the log is fed in at the speed it was recorded. Results that arrive while the scanner is
+busy wait in a queue the size of the BLE stack's, and are dropped when it is full. With --fast the
+results are fed in as quickly as the scanner will take them, which gives its maximum throughput.
+The keys are rolled alongside, as the keyroller would, using the time in the log as the clock.
+"""
+import argparse
+import asyncio
+import time
+
+import host
+import aioble
+import airtag
+import scanner
+import capture
+import log
+from time import ticks_us, ticks_diff
+
+# How many results can wait for the scanner before they are dropped
+QUEUE_SIZE = 32
+
+class Replay:
+    """
+    Stands in for aioble.scan(), handing out the results in a log
+    """
+    def __init__(self, start, records, realtime):
+        self.start = start
+        self.records = records
+        self.realtime = realtime
+        self.queue = []
+        self.ready = asyncio.Event()
+        self.finished = False
+        # Set once every result has been handed out. The scanner would just start again, so this is
+        # what ends the replay
+        self.done = asyncio.Event()
+        # Where we are in the log
+        self.ms = 0
+        # When the result being handled now arrived
+        self.arrived = 0
+        self.packets = 0
+        self.processed = 0
+        self.dropped = 0
+        self.latencies = []
+        self.detections = {}
+
+    def time(self):
+        """
+        The clock, as it was when the log was recorded
+        """
+        return self.start + self.ms // 1000
+
+    def scan(self, duration_ms, interval_us = None, window_us = None, active = False):
+        return self
+
+    async def __aenter__(self):
+        if self.realtime:
+            self.feeder = asyncio.create_task(self.feed())
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.realtime:
+            record = next(self.records, None)
+            if record == None:
+                self.done.set()
+                raise StopAsyncIteration
+            self.ms = record.ms
+            self.packets += 1
+            self.processed += 1
+            # Give the other tasks a turn, as waiting for the radio would
+            await asyncio.sleep(0)
+            self.arrived = ticks_us()
+            return record
+
+        while len(self.queue) == 0:
+            if self.finished:
+                self.done.set()
+                raise StopAsyncIteration
+            self.ready.clear()
+            await self.ready.wait()
+        record, self.arrived = self.queue.pop(0)
+        self.processed += 1
+        return record
+
+    async def feed(self):
+        """
+        Put the results in the queue at the times they were heard
+        """
+        began = time.monotonic()
+        for record in self.records:
+            delay = record.ms / 1000 - (time.monotonic() - began)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.ms = record.ms
+            self.packets += 1
+            if len(self.queue) >= QUEUE_SIZE:
+                self.dropped += 1
+                continue
+            self.queue.append((record, ticks_us()))
+            self.ready.set()
+        self.finished = True
+        self.ready.set()
+
+    def found(self, name, index, rssi):
+        self.latencies.append(ticks_diff(ticks_us(), self.arrived))
+        self.detections[name] = self.detections.get(name, 0) + 1
+
+
+async def roll_keys():
+    while True:
+        await airtag.update_keys_async()
+        await asyncio.sleep(1)
+
+
+async def replay(log, keys, realtime):
+    start, records = capture.read(log)
+    driver = Replay(start, records, realtime)
+    aioble.scan = driver.scan
+    airtag.time = driver.time
+    if keys != None:
+        airtag.load_keys(keys)
+        airtag.rehydrate_keys()
+        airtag.update_keys()
+
+    # As if a switch were waiting for its tag, so the scanner is flat out
+    scanner.set_active(True)
+    roller = asyncio.create_task(roll_keys())
+    began = time.monotonic()
+    scanning = asyncio.create_task(scanner.scan_devices(driver.found))
+    await driver.done.wait()
+    elapsed = time.monotonic() - began
+    scanning.cancel()
+    roller.cancel()
+
+    print(f"Replayed {driver.packets} results covering {driver.ms / 1000:.1f}s of capture in {elapsed:.1f}s")
+    print(f"Processed {driver.processed} ({driver.processed / elapsed:.0f}/s), dropped {driver.dropped}")
+    print(f"Detections: {driver.detections}")
+    if len(driver.latencies) > 0:
+        mean = sum(driver.latencies) / len(driver.latencies)
+        print(f"Detection latency: mean {mean / 1000:.2f}ms, max {max(driver.latencies) / 1000:.2f}ms")
+    print(scanner.address_cache)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Replay a scan log through the detection path")
+    parser.add_argument("log", help = "log recorded by the puck (see CAPTURE_FILE in main.py)")
+    parser.add_argument("--keys", help = "keys file, as copied to the puck")
+    parser.add_argument("--fast", action = "store_true", help = "feed the log in as fast as it is handled")
+    parser.add_argument("--verbose", action = "store_true", help = "show what the puck would print")
+    args = parser.parse_args()
+    if not args.verbose:
+        log.level = log.ERROR + 1
+    asyncio.run(replay(args.log, args.keys, not args.fast))
+
+if __name__ == "__main__":
+    main()